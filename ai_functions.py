@@ -0,0 +1,167 @@
+from entities import NEIGHBOURS
+from map_system_2 import UNREACHABLE
+import numpy
+
+NEIGHBOUR_OFFSETS = numpy.array(NEIGHBOURS)
+
+MAX_WANDER_TURNS = 50
+
+
+def take_monster_turns(target, game_map, entities, monsters=None):
+    """
+    The given monsters in the target's room (all of them by default) take their turns at once, with the same
+    outcome as each of them chasing the target on its own, in order (legacy_take_turn in benchmarks.py). Visibility,
+    distances and each monster's choice of downhill step are worked out as arrays; then one pass over the monsters,
+    in order, attacks and resolves moves against a grid of occupied tiles. Returns every monster's turn results, in
+    the order the monsters acted, with an "attacker" result for each monster that attacked.
+    """
+    results = []
+
+    room = game_map.rooms[target.map_x][target.map_y]
+    room_entities = entities.in_room(target.current_room)
+
+    if monsters is None:
+        monsters = [entity for entity in room_entities if entity.ai]
+
+    if not monsters:
+        return results
+
+    positions = numpy.array([(monster.room_x, monster.room_y) for monster in monsters])
+    target_position = numpy.array((target.room_x, target.room_y))
+
+    visible = room.fov[positions[:, 0], positions[:, 1]]
+    distances_squared = ((positions - target_position) ** 2).sum(axis=1)
+    moving = visible & (distances_squared >= 4)  # Two tiles or more away - the same test as distance_to() >= 2.
+
+    if moving.any():
+        step_choices, downhill = rank_downhill_steps(room, positions[moving], target_position)
+        step_numbers = numpy.cumsum(moving) - 1  # Each moving monster's row in the step arrays.
+
+    walkable = room.walkable
+
+    # How many blocking entities stand on each tile, kept up to date as monsters move.
+    occupied = numpy.zeros((room.room_width, room.room_height), dtype=numpy.int32)
+    for entity in room_entities:
+        if entity.blocks:
+            occupied[entity.room_x, entity.room_y] += 1
+
+    for number, monster in enumerate(monsters):
+        if not visible[number]:
+            continue
+
+        if moving[number]:
+            start = (monster.room_x, monster.room_y)
+            row = step_numbers[number]
+
+            for step in step_choices[row][downhill[row]]:
+                dx, dy = NEIGHBOURS[step]
+
+                if not occupied[monster.room_x + dx, monster.room_y + dy]:
+                    monster.move(dx, dy)
+                    break
+            else:
+                step_around_blockers(monster, room, walkable, occupied, target)
+
+            if monster.blocks:
+                occupied[start] -= 1
+                occupied[monster.room_x, monster.room_y] += 1
+
+        elif target.fighter.hits > 0:
+            results.append({"attacker": monster})
+            results.extend(monster.fighter.attack(target))
+
+            if target.fighter.hits <= 0:  # The target is dead, so nobody else gets a turn.
+                break
+
+    return results
+
+
+def step_around_blockers(monster, room, walkable, occupied, target):
+    # Like the old per-monster A* fallback, with every other blocker masked out of the walkable layer at once for the A* search.
+    blocked = (occupied > 0) & walkable
+    blocked[monster.room_x, monster.room_y] = occupied[monster.room_x, monster.room_y] > 1  # Other than the monster.
+    blocked[target.room_x, target.room_y] = False
+
+    walkable[blocked] = False
+    path = room.compute_path(monster.room_x, monster.room_y, target.room_x, target.room_y)
+    walkable[blocked] = True
+
+    if path and not occupied[path[0]]:
+        monster.move(path[0][0] - monster.room_x, path[0][1] - monster.room_y)
+
+
+def rank_downhill_steps(room, positions, target_position):
+    """
+    For each position, the eight neighbouring steps in the order a monster prefers them: nearest the target on
+    the room's flow field first, then most direct, then first in NEIGHBOURS. Returns (step_choices, downhill):
+    indexes into NEIGHBOURS, and whether each of those steps is in the room and downhill from the position.
+    """
+    flow_field = room.compute_flow_field(target_position[0], target_position[1])
+    room_size = numpy.array((room.room_width, room.room_height))
+
+    neighbours = positions[:, numpy.newaxis, :] + NEIGHBOUR_OFFSETS[numpy.newaxis, :, :]
+    in_room = ((neighbours >= 0) & (neighbours < room_size)).all(axis=2)
+
+    clipped = numpy.clip(neighbours, 0, room_size - 1)
+    flow_distances = numpy.where(in_room, flow_field[clipped[:, :, 0], clipped[:, :, 1]], UNREACHABLE)
+    straightness = ((neighbours - target_position) ** 2).sum(axis=2)
+
+    downhill = in_room & (flow_distances < flow_field[positions[:, 0], positions[:, 1]][:, numpy.newaxis])
+
+    # lexsort is stable, so steps that tie on both keys stay in NEIGHBOURS order.
+    step_choices = numpy.lexsort((straightness, flow_distances), axis=1)
+
+    return step_choices, numpy.take_along_axis(downhill, step_choices, axis=1)
+
+
+def wander_monsters(room, room_entities, turns, random_generator):
+    """
+    Fast-forwards the monsters in a room nobody is watching by up to turns turns (capped at MAX_WANDER_TURNS, after
+    which a random walk has long since forgotten where it started). Every turn, all monsters try a random step at
+    once; steps off the walkable tiles, onto blockers or onto a tile another monster picked first are dropped.
+    Returns the number of turns simulated.
+    """
+    monsters = [entity for entity in room_entities if entity.ai]
+    turns = min(turns, MAX_WANDER_TURNS)
+
+    if not monsters or turns <= 0:
+        return 0
+
+    room_size = numpy.array((room.room_width, room.room_height))
+    walkable = room.walkable
+
+    occupied = numpy.zeros((room.room_width, room.room_height), dtype=numpy.int32)
+    for entity in room_entities:
+        if entity.blocks:
+            occupied[entity.room_x, entity.room_y] += 1
+
+    start_positions = numpy.array([(monster.room_x, monster.room_y) for monster in monsters])
+    positions = start_positions.copy()
+    blocking = numpy.array([monster.blocks for monster in monsters])
+    monster_numbers = numpy.arange(len(monsters))
+
+    for turn in range(turns):
+        steps = positions + NEIGHBOUR_OFFSETS[random_generator.integers(0, len(NEIGHBOURS), len(monsters))]
+        clipped = numpy.clip(steps, 0, room_size - 1)
+
+        free = ((steps >= 0) & (steps < room_size)).all(axis=1) & walkable[clipped[:, 0], clipped[:, 1]] & \
+            (occupied[clipped[:, 0], clipped[:, 1]] == 0)
+
+        # Where several monsters picked the same tile, only the first of them gets it.
+        tiles = numpy.where(free, clipped[:, 0] * room.room_height + clipped[:, 1], -1 - monster_numbers)
+        first_picks = numpy.unique(tiles, return_index=True)[1]
+        moving = numpy.zeros(len(monsters), dtype=bool)
+        moving[first_picks] = True
+        moving &= free
+
+        moving_blockers = moving & blocking
+        numpy.subtract.at(occupied, (positions[moving_blockers, 0], positions[moving_blockers, 1]), 1)
+        numpy.add.at(occupied, (steps[moving_blockers, 0], steps[moving_blockers, 1]), 1)
+
+        positions[moving] = steps[moving]
+
+    for monster, (dx, dy) in zip(monsters, (positions - start_positions).tolist()):
+        if dx or dy:
+            monster.move(dx, dy)
+
+    return turns
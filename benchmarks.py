@@ -0,0 +1,543 @@
+from copy import deepcopy
+from map_system_2 import GameMap, create_path, create_branched_rooms, create_loops, lay_out_rooms, find_loop_candidates, \
+    place_entities, pick_monster, validate_coords, get_opposite_exit, step_across_rooms, EXIT_DIRECTIONS, LOOP_FRACTION
+from entities import Actor, EntityRegistry, NEIGHBOURS, get_blocking_entities_at_location
+from game_session import GameSession, replay, load_recording
+from game_states import GameStates
+from save_functions import pack_game, unpack_game
+from ai_functions import take_monster_turns
+from pathfinding import PathFinder, DOORWAYS
+import templates
+import rng
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+# Every action handle_keys can produce during play, for driving scripted games.
+SCRIPTED_ACTIONS = [{'move': (0, -1)}, {'move': (0, 1)}, {'move': (-1, 0)}, {'move': (1, 0)},
+                    {'move': (-1, -1)}, {'move': (1, -1)}, {'move': (-1, 1)}, {'move': (1, 1)},
+                    {'select_hand': "left"}, {'select_hand': "right"}, {'drop_item': True}, {'pickup_item': True}]
+
+
+def legacy_shuffle_rooms(game_map, player, entities):
+    """
+    The original deepcopy based shuffle, kept here as the "before" side of the shuffle benchmark.
+    """
+    viable_coordinates = []
+
+    for y in range(game_map.map_height):
+        for x in range(game_map.map_width):
+            viable_coordinates.append((x, y))
+
+    viable_coordinates.remove((player.map_x, player.map_y))
+    rng.shuffle(viable_coordinates)
+
+    final_copy_x, final_copy_y = viable_coordinates[0]
+    final_copied_room = deepcopy(game_map.rooms[final_copy_x][final_copy_y])
+
+    while len(viable_coordinates) > 1:
+        replace_x, replace_y = viable_coordinates.pop(0)
+        copy_x, copy_y = viable_coordinates[0]
+        copied_room = deepcopy(game_map.rooms[copy_x][copy_y])
+        game_map.rooms[replace_x][replace_y] = copied_room
+
+    final_replace_x, final_replace_y = viable_coordinates.pop(0)
+    game_map.rooms[final_replace_x][final_replace_y] = final_copied_room
+
+    for y in range(game_map.map_height):
+        for x in range(game_map.map_width):
+            game_map.rooms_index[game_map.rooms[x][y].room_id]["map_x"] = x
+            game_map.rooms_index[game_map.rooms[x][y].room_id]["map_y"] = y
+
+    for entity in entities:
+        if entity is not player:
+            entity.set_map_position(game_map)
+
+
+def create_benchmark_map(map_size):
+    game_map = GameMap(map_size, map_size)
+    entities = EntityRegistry()
+
+    # Allocate every room, so both shuffles move a full map.
+    for map_x in range(map_size):
+        for map_y in range(map_size):
+            game_map.materialise_room(map_x, map_y)
+
+    player = Actor(game_map, "0x0", 15, 15, "Player", "@", (255, 255, 255))
+    entities.append(player)
+
+    return game_map, entities, player
+
+
+def time_calls(function, repeats, *args):
+    start = time.perf_counter()
+    for i in range(repeats):
+        function(*args)
+    return (time.perf_counter() - start) / repeats
+
+
+def benchmark_shuffle_rooms(map_sizes=(20, 50, 100), repeats=3):
+    results = []
+
+    for map_size in map_sizes:
+        game_map, entities, player = create_benchmark_map(map_size)
+
+        after = time_calls(game_map.shuffle_rooms, repeats, player, entities)
+        before = time_calls(legacy_shuffle_rooms, repeats, game_map, player, entities)
+
+        results.append({"map_size": map_size, "before_ms": before * 1000, "after_ms": after * 1000})
+
+    return results
+
+
+def play_scripted_game(turns, action_picker, seed=None):
+    session = GameSession(seed=seed)
+
+    for turn in range(turns):
+        session.step(action_picker.choice(SCRIPTED_ACTIONS))
+
+    return session
+
+
+def benchmark_headless_games(games=20, turns=200):
+    # Plays random games with no window, the way a balance or soak test on CI would.
+    action_picker = random.Random(0)
+
+    fov_cache_hits = 0
+    fov_cache_misses = 0
+
+    start = time.perf_counter()
+    for game in range(games):
+        fov_cache_stats = play_scripted_game(turns, action_picker).game_map.fov_cache_stats()
+        fov_cache_hits += fov_cache_stats["hits"]
+        fov_cache_misses += fov_cache_stats["misses"]
+    elapsed = time.perf_counter() - start
+
+    return {"games": games, "turns": turns, "seconds": elapsed, "games_per_minute": games / elapsed * 60,
+            "fov_cache_hits": fov_cache_hits, "fov_cache_misses": fov_cache_misses}
+
+
+def get_final_state(session):  # A fingerprint of where a run ended up, to check a replay matched the original.
+    return [(entity.name, entity.current_room, entity.room_x, entity.room_y, entity.fighter.hits if entity.fighter else None)
+            for entity in session.entities]
+
+
+def benchmark_replay(recording=None, turns=1000, repeats=5):
+    # Replays a recorded game at full speed. Without a recording, a seeded scripted game is recorded first.
+    if recording is None:
+        recorded_session = play_scripted_game(turns, random.Random(0), seed=0)
+        recording = recorded_session.recording()
+        expected_state = get_final_state(recorded_session)
+    else:
+        expected_state = None
+
+    start = time.perf_counter()
+    for i in range(repeats):
+        session = replay(recording)
+    elapsed = (time.perf_counter() - start) / repeats
+
+    result = {"seed": recording["seed"], "actions": len(recording["actions"]), "replay_ms": elapsed * 1000,
+              "actions_per_second": len(recording["actions"]) / elapsed}
+
+    if expected_state is not None:
+        result["matches_recording"] = get_final_state(session) == expected_state
+
+    return result
+
+
+
+def generate_map_in_phases(map_size, seed, phase_times=None):
+    """
+    Generates a map the same way generate_map does, one phase at a time, and places monsters in every carved
+    room. If phase_times is given, the seconds spent in each phase are written into it.
+    """
+    if phase_times is None:
+        phase_times = {}
+
+    rng.seed(seed)
+
+    start = time.perf_counter()
+    game_map = GameMap(map_size, map_size)
+    entities = EntityRegistry()
+    phase_times["allocation"] = time.perf_counter() - start
+
+    # Carving happens as the path and branches link rooms together.
+    all_rooms = {}
+
+    start = time.perf_counter()
+    create_path(game_map, path_length=10, source_x=map_size // 2, source_y=map_size // 2, all_rooms=all_rooms)
+    phase_times["path"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    create_branched_rooms(game_map, iterations=5, all_rooms=all_rooms)
+    phase_times["branching"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    create_loops(game_map, loop_fraction=LOOP_FRACTION)
+    phase_times["loops"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lay_out_rooms(game_map)
+    phase_times["layout"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for branch_level in all_rooms:
+        for room in all_rooms[branch_level]:
+            place_entities(game_map, room, entities, 5, 1)
+    phase_times["placement"] = time.perf_counter() - start
+
+    return game_map, entities
+
+
+def benchmark_map_generation(seeds=range(10), map_sizes=(20,)):
+    results = []
+
+    for map_size in map_sizes:
+        for seed in seeds:
+            phase_times = {}
+
+            start = time.perf_counter()
+            game_map, entities = generate_map_in_phases(map_size, seed, phase_times)
+            total = time.perf_counter() - start
+
+            # Measure memory on a second run of the same seed, so tracing doesn't skew the timings.
+            tracemalloc.start()
+            generate_map_in_phases(map_size, seed)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            result = {"map_size": map_size, "seed": seed, "total_ms": total * 1000, "peak_memory_kb": peak_memory / 1024,
+                      "entities": len(entities)}
+            for phase in phase_times:
+                result[phase + "_ms"] = phase_times[phase] * 1000
+
+            results.append(result)
+
+    return results
+
+
+def summarise_map_generation(results):
+    # Mean of every timing and memory column for each map size.
+    summary = []
+
+    for map_size in sorted(set(result["map_size"] for result in results)):
+        runs = [result for result in results if result["map_size"] == map_size]
+        row = {"map_size": map_size, "maps": len(runs)}
+
+        for key in runs[0]:
+            if key.endswith("_ms") or key.endswith("_kb"):
+                row[key] = sum(run[key] for run in runs) / len(runs)
+
+        summary.append(row)
+
+    return summary
+
+
+def legacy_find_loop_candidates(game_map):
+    """
+    Finds the same loop candidates as find_loop_candidates by checking every carved room against every other, the
+    naive way, as the "before" side of the loops benchmark.
+    """
+    rooms = [(entry["map_x"], entry["map_y"], game_map.rooms[entry["map_x"]][entry["map_y"]])
+             for entry in game_map.rooms_index.values()]
+    candidates = []
+
+    for map_x, map_y, room in rooms:
+        for exit_type, (dx, dy) in EXIT_DIRECTIONS.items():
+            if dx < 0 or dy < 0:
+                continue
+
+            neighbour_x, neighbour_y = validate_coords(map_x, map_y, dx, dy, game_map.map_width, game_map.map_height)
+
+            for other_x, other_y, other_room in rooms:
+                if (other_x, other_y) == (neighbour_x, neighbour_y) and other_room is not room and \
+                        other_room.branch_level != room.branch_level and \
+                        not (getattr(room.room_layout, exit_type.name) and
+                             getattr(other_room.room_layout, get_opposite_exit(exit_type).name)):
+                    candidates.append((room, exit_type, other_room))
+
+    return candidates
+
+
+def create_branching_map(map_size, seed, path_length, iterations):
+    # A map with far more rooms than generate_map makes, from one long path and its branches.
+    rng.seed(seed)
+    game_map = GameMap(map_size, map_size)
+    all_rooms = {}
+
+    create_path(game_map, path_length=path_length, source_x=map_size // 2, source_y=map_size // 2, all_rooms=all_rooms)
+    create_branched_rooms(game_map, iterations=iterations, all_rooms=all_rooms)
+
+    return game_map
+
+
+def benchmark_loop_candidates(map_sizes=(20, 50, 100), seed=0, repeats=3):
+    # Times finding the loop candidates both ways, on maps with a path as long as the map is wide, and its branches.
+    results = []
+
+    for map_size in map_sizes:
+        game_map = create_branching_map(map_size, seed, path_length=map_size * 10, iterations=map_size)
+
+        before = time_calls(legacy_find_loop_candidates, repeats, game_map)
+        after = time_calls(find_loop_candidates, repeats, game_map)
+
+        same_candidates = [(room.room_id, exit_type) for room, exit_type, neighbour in legacy_find_loop_candidates(game_map)] == \
+                          [(room.room_id, exit_type) for room, exit_type, neighbour in find_loop_candidates(game_map)]
+
+        results.append({"map_size": map_size, "rooms": len(game_map.rooms_index),
+                        "branches": len(set(room.branch_level for room in game_map.materialised_rooms())),
+                        "candidates": len(find_loop_candidates(game_map)),
+                        "before_ms": before * 1000, "after_ms": after * 1000, "same_candidates": same_candidates})
+
+    return results
+
+
+def benchmark_travel(map_sizes=(20, 50, 100), seed=0):
+    """
+    Walks an actor with the hierarchical pathfinder between the two rooms furthest apart in the biggest connected
+    part of a long-path map, timing every step, to show a step costs the same whatever the size of the map.
+    """
+    results = []
+
+    for map_size in map_sizes:
+        game_map = create_branching_map(map_size, seed, path_length=map_size * 10, iterations=map_size)
+        create_loops(game_map, loop_fraction=LOOP_FRACTION)
+        lay_out_rooms(game_map)
+        game_map.room_graph.rebuild()
+
+        rooms = game_map.room_graph.components()[0]
+        start_room = rooms[0]
+        goal_room = max(rooms, key=lambda room_id: len(game_map.room_graph.find_route(start_room, room_id)))
+
+        room_x, room_y = DOORWAYS[next(iter(game_map.room_graph.exits[start_room]))]
+        actor = Actor(game_map, start_room, room_x, room_y, "Traveller", "@", (255, 255, 255))
+        entities = EntityRegistry()
+        entities.append(actor)
+
+        pathfinder = PathFinder(game_map)
+        steps = 0
+
+        start = time.perf_counter()
+        while actor.current_room != goal_room:
+            step = pathfinder.next_step(actor, goal_room, entities)
+            if not step:
+                break
+
+            actor.place(game_map, *step_across_rooms(game_map, actor.map_x, actor.map_y, actor.room_x, actor.room_y, *step))
+            steps += 1
+        elapsed = time.perf_counter() - start
+
+        results.append({"map_size": map_size, "tiles": len(game_map.rooms_index) * 30 * 30,
+                        "route_rooms": len(game_map.room_graph.find_route(start_room, goal_room)),
+                        "arrived": actor.current_room == goal_room, "steps": steps,
+                        "ms_per_step": elapsed * 1000 / max(steps, 1), "exit_fields": len(pathfinder.exit_fields)})
+
+    return results
+
+
+def print_results(rows):
+    columns = list(rows[0])
+    print("  ".join("{:>14}".format(column) for column in columns))
+
+    for row in rows:
+        print("  ".join("{:>14.2f}".format(row[column]) if isinstance(row[column], float) else "{:>14}".format(str(row[column]))
+                        for column in columns))
+
+
+def benchmark_save_load(seeds=range(10), map_sizes=(20,)):
+    # Packs and unpacks a generated map with monsters in every carved room. There's no player, so a monster stands in.
+    results = []
+
+    for map_size in map_sizes:
+        for seed in seeds:
+            game_map, entities = generate_map_in_phases(map_size, seed)
+            player = next(iter(entities))
+
+            start = time.perf_counter()
+            data = pack_game(game_map, entities, player)
+            save_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            unpack_game(data)
+            load_time = time.perf_counter() - start
+
+            results.append({"map_size": map_size, "seed": seed, "save_ms": save_time * 1000, "load_ms": load_time * 1000,
+                            "size_kb": len(data) / 1024})
+
+    return results
+
+
+def legacy_move_towards(monster, target_map_x, target_map_y, target_room_x, target_room_y, game_map, entities):
+    room = game_map.rooms[target_map_x][target_map_y]
+    flow_field = room.compute_flow_field(target_room_x, target_room_y)
+
+    # Walk downhill on the room's flow field - the neighbouring tile nearest the target that is free.
+    best_step = None
+    best_distance = flow_field[monster.room_x, monster.room_y]
+    best_straightness = None
+
+    for dx, dy in NEIGHBOURS:
+        x = monster.room_x + dx
+        y = monster.room_y + dy
+
+        if not (0 <= x < room.room_width and 0 <= y < room.room_height):
+            continue
+
+        if flow_field[x, y] > best_distance or (flow_field[x, y] == best_distance and best_step is None):
+            continue
+
+        if get_blocking_entities_at_location(entities, monster.current_room, x, y):
+            continue
+
+        # Between equally close tiles prefer the one most directly towards the target.
+        straightness = (target_room_x - x) ** 2 + (target_room_y - y) ** 2
+
+        if flow_field[x, y] < best_distance or straightness < best_straightness:
+            best_step = (dx, dy)
+            best_distance = flow_field[x, y]
+            best_straightness = straightness
+
+    if best_step:
+        monster.move(*best_step)
+    else:
+        legacy_move_astar(monster, room, target_room_x, target_room_y, entities)
+
+
+def legacy_move_astar(monster, room, target_room_x, target_room_y, entities):
+    # The flow field is blocked by other entities, so path around them with A*, treating them as walls.
+    blocked_tiles = []
+    for entity in entities.in_room(monster.current_room):
+        if entity.blocks and entity is not monster \
+                and (entity.room_x, entity.room_y) != (target_room_x, target_room_y) \
+                and room.walkable[entity.room_x, entity.room_y]:
+            blocked_tiles.append((entity.room_x, entity.room_y))
+            room.walkable[entity.room_x, entity.room_y] = False
+
+    path = room.compute_path(monster.room_x, monster.room_y, target_room_x, target_room_y)
+
+    for x, y in blocked_tiles:
+        room.walkable[x, y] = True
+
+    if path and not get_blocking_entities_at_location(entities, monster.current_room, path[0][0], path[0][1]):
+        monster.move(path[0][0] - monster.room_x, path[0][1] - monster.room_y)
+
+
+def legacy_take_turn(monster, target, game_map, entities):  # One monster's turn, worked out on its own.
+    results = []
+
+    if game_map.rooms[target.map_x][target.map_y].fov[monster.room_x, monster.room_y]:
+        if monster.distance_to(target) >= 2:
+            legacy_move_towards(monster, target.map_x, target.map_y, target.room_x, target.room_y, game_map, entities)
+
+        elif target.fighter.hits > 0:
+            results.extend(monster.fighter.attack(target))
+
+    return results
+
+
+def legacy_enemy_turn(session):
+    """
+    The original enemy turn, each monster chasing the player on its own, one after another, kept as the "before"
+    side of the crowd benchmark.
+    """
+    turn_results = []
+
+    for entity in list(session.entities.in_room(session.player.current_room)):
+        if entity.ai:
+            turn_results.extend(session.resolve_results(legacy_take_turn(entity, session.player, session.game_map, session.entities)))
+
+            if session.game_state == GameStates.PLAYER_DEAD:
+                break
+
+    return turn_results
+
+
+def create_crowded_session(monster_count, seed):
+    # A seeded game with monster_count extra monsters on random tiles of the player's room, and an unkillable player.
+    session = GameSession(seed=seed)
+    session.player.fighter.hits = 10 ** 9
+
+    room = session.game_map.rooms[session.player.map_x][session.player.map_y]
+    free_tiles = [(x, y) for x, y in room.walkable_cells().tolist() if (x, y) != (session.player.room_x, session.player.room_y)]
+    random.Random(seed).shuffle(free_tiles)
+
+    for x, y in free_tiles[:monster_count]:
+        session.entities.append(pick_monster(session.game_map, session.player.current_room, x, y, templates.lunatic))
+
+    session.recompute_fov()
+
+    return session
+
+
+def benchmark_crowded_room(monster_counts=(10, 60, 200), turns=30, seed=0):
+    results = []
+
+    for monster_count in monster_counts:
+        before_session = create_crowded_session(monster_count, seed)
+        after_session = create_crowded_session(monster_count, seed)
+
+        before = time_calls(legacy_enemy_turn, turns, before_session)
+        after = time_calls(lambda: after_session.resolve_results(
+            take_monster_turns(after_session.player, after_session.game_map, after_session.entities)), turns)
+
+        same_outcome = [(entity.room_x, entity.room_y) for entity in before_session.entities] == \
+                       [(entity.room_x, entity.room_y) for entity in after_session.entities]
+
+        results.append({"monsters": monster_count, "before_ms": before * 1000, "after_ms": after * 1000,
+                        "same_outcome": same_outcome})
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="7DRL 2019 benchmarks.")
+    parser.add_argument("benchmark", choices=["mapgen", "shuffle", "headless", "replay", "save", "crowd", "loops", "travel"])
+    parser.add_argument("--maps", type=int, default=10, help="mapgen and save: number of seeds to generate for each map size.")
+    parser.add_argument("--first-seed", type=int, default=0, help="mapgen and save: the first seed, counting up from here.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20], help="mapgen, save, shuffle, loops and travel: map widths (maps are square).")
+    parser.add_argument("--games", type=int, default=20, help="headless: number of games to play.")
+    parser.add_argument("--turns", type=int, default=200, help="headless and crowd: turns per game.")
+    parser.add_argument("--monsters", type=int, nargs="+", default=[10, 60, 200], help="crowd: monsters in the room.")
+    parser.add_argument("--recording", help="replay: a recording saved by the game with --record.")
+    parser.add_argument("--per-map", action="store_true", help="mapgen and save: report every map rather than the means per size.")
+    parser.add_argument("--json", action="store_true", help="Print machine readable JSON instead of a table.")
+    args = parser.parse_args()
+
+    if args.benchmark == "mapgen":
+        results = benchmark_map_generation(range(args.first_seed, args.first_seed + args.maps), args.sizes)
+        if not args.per_map:
+            results = summarise_map_generation(results)
+
+    elif args.benchmark == "shuffle":
+        results = benchmark_shuffle_rooms(args.sizes)
+
+    elif args.benchmark == "save":
+        results = benchmark_save_load(range(args.first_seed, args.first_seed + args.maps), args.sizes)
+        if not args.per_map:
+            results = summarise_map_generation(results)
+
+    elif args.benchmark == "travel":
+        results = benchmark_travel(args.sizes)
+
+    elif args.benchmark == "loops":
+        results = benchmark_loop_candidates(args.sizes)
+
+    elif args.benchmark == "crowd":
+        results = benchmark_crowded_room(args.monsters, args.turns)
+
+    elif args.benchmark == "headless":
+        results = [benchmark_headless_games(args.games, args.turns)]
+
+    else:
+        results = [benchmark_replay(load_recording(args.recording) if args.recording else None)]
+
+    if args.json:
+        print(json.dumps({"benchmark": args.benchmark, "results": results}, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
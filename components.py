@@ -1,17 +1,21 @@
 from copy import deepcopy
 from message_log import Message
 from entities import Item
-from random import choice
+from rng import choice
 
 
 class Fighter:
-    def __init__(self, hits, left_hand=None, right_hand=None):
+    __slots__ = ("hits", "max_hits", "left_hand", "right_hand", "selected_hand", "owner")
+
+    def __init__(self, hits, left_hand=None, right_hand=None, selected_hand=None):
         self.hits = hits
         self.max_hits = hits
         self.left_hand = left_hand
         self.right_hand = right_hand
 
-        if self.right_hand and not self.left_hand:
+        if selected_hand:
+            self.selected_hand = selected_hand
+        elif self.right_hand and not self.left_hand:
             self.selected_hand = "right"
         elif self.left_hand and not self.right_hand:
             self.selected_hand = "left"
@@ -42,14 +46,12 @@ class Fighter:
         if active_hand:
             return Message("You're already holding something in this hand.", (255, 255, 255))
         else:
-            for entity in entities:
+            for entity in entities.at(self.owner.current_room, self.owner.room_x, self.owner.room_y):
                 if isinstance(entity, Item):
-                    if entity.map_x == self.owner.map_x and entity.map_y == self.owner.map_y:
-                        if entity.room_x == self.owner.room_x and entity.room_y == self.owner.room_y:
-                            self.equip_item(entity)
-                            item_name = entity.name
-                            entities.remove(entity)
-                            return Message("You pickup the {}".format(item_name), (255, 255, 255))
+                    self.equip_item(entity)
+                    item_name = entity.name
+                    entities.remove(entity)
+                    return Message("You pickup the {}".format(item_name), (255, 255, 255))
             else:
                 return Message("There's nothing here to pick up.", (255, 255, 255))
 
@@ -114,25 +116,21 @@ class Fighter:
 
 
 class BasicMonster:
-    def take_turn(self, target, game_map, entities):
-        results = []
-
-        monster = self.owner
+    __slots__ = ("owner",)
 
-        if game_map.rooms[target.map_x][target.map_y].fov[monster.room_x, monster.room_y]:
-            if monster.distance_to(target) >= 2:
-                monster.move_towards(target.map_x, target.map_y, target.room_x, target.room_y, game_map, entities)
-
-            elif target.fighter.hits > 0:
-                attack_results = monster.fighter.attack(target)
-                results.extend(attack_results)
+    def take_turn(self, target, game_map, entities):
+        # Imported here as ai_functions needs map_system_2, which needs this module.
+        from ai_functions import take_monster_turns
 
-        return results
+        return take_monster_turns(target, game_map, entities, [self.owner])
 
 
 # Item Components
 class Weapon:
-    def __init__(self, power, uses):
+    __slots__ = ("power", "uses", "max_uses", "speed")
+
+    def __init__(self, power, uses, speed=100):
         self.power = power
         self.uses = uses
         self.max_uses = uses
+        self.speed = speed  # 100 is normal; faster weapons make attacks take less time.
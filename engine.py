@@ -1,22 +1,21 @@
 import tdl
-from map_system_2 import GameMap, generate_map
-from entities import Actor, Item, get_blocking_entities_at_location
-from game_states import GameStates
-from render import render_all, clear_all
+import argparse
+from game_session import GameSession, save_recording
+from render import RenderState, render_all
 from input_functions import handle_keys
-from message_log import MessageLog
-from death_functions import kill_monster, kill_player
-from components import Fighter, Weapon
+from message_log import Message, MessageLog, MessageAggregator
+from minimap import Minimap
+from map_system_2 import ROOM_WIDTH, ROOM_HEIGHT
 
-def main():
+def main(seed=None, level_pack=None, level=None, record=None):
     tdl.set_font('terminal16x16.png', greyscale=True, altLayout=False)  # Load the font from a png.
     tdl.set_fps(100)
 
     map_width = 20
     map_height = 20
 
-    room_width = 30
-    room_height = 30
+    room_width = ROOM_WIDTH
+    room_height = ROOM_HEIGHT
 
     screen_width = room_width + 22
     screen_height = room_height + 22
@@ -25,38 +24,25 @@ def main():
     top_panel_console = tdl.Console(screen_width, 10)
     view_port_console = tdl.Console(room_width, room_height)
     bottom_panel_console = tdl.Console(screen_width, 10)
+    minimap = Minimap(tdl.Console(room_width, room_height), room_width, room_height)  # Toggled with m, t travels.
     message_log = MessageLog(0, 0, screen_width, 9)
+    message_aggregator = MessageAggregator()  # Collapses each turn's repeated messages before they reach the log.
 
-    entities = []
-
-    game_map = GameMap(map_width, map_height)
-
-    sword_stats = Weapon(2, 10)
-    player_weapon = Item(game_map, "0x0", 0, 0, "Sword", "|", (255, 255, 255), weapon=sword_stats)
-    player_stats = Fighter(hits=10, left_hand=player_weapon)
-    player = Actor(game_map, "2x2", 15, 10, "Player", "@", (255, 255, 255), fighter=player_stats)
-    entities.append(player)
-
-    generate_map(game_map, entities, player)
+    # All of the game itself lives in the session - this loop just feeds it key presses and draws the results.
+    session = GameSession(map_width, map_height, seed=seed, level_pack=level_pack, level=level)
+    session.game_map.print_map()
 
     all_consoles = [root_console, view_port_console, bottom_panel_console, top_panel_console]
 
-    fov_algorithm = "BASIC"
-    fov_light_walls = True
-    fov_radius = 50
     fov_recompute = True
 
-    game_state = GameStates.PLAYER_TURN
+    force_full_redraw = False  # Redraw the whole screen every frame rather than only what changed.
+    render_state = RenderState(full_redraw=force_full_redraw)
 
     while not tdl.event.is_window_closed():
-        if fov_recompute:  # Compute the field of view to show changes.
-            game_map.rooms[player.map_x][player.map_y]\
-                .compute_fov(player.room_x, player.room_y,
-                             fov=fov_algorithm, radius=fov_radius, light_walls=fov_light_walls, sphere=True)
-
-            render_all(all_consoles, game_map, entities, player, fov_recompute, message_log)
+        if fov_recompute:  # Draw the changes since the last turn.
+            render_all(all_consoles, session.game_map, session.entities, session.player, fov_recompute, message_log, render_state, minimap)
             tdl.flush()
-            clear_all(view_port_console, entities)
             fov_recompute = False
 
         for event in tdl.event.get():
@@ -67,161 +53,67 @@ def main():
         else:
             user_input = None
 
-        if not user_input:
-            continue
-
-        action = handle_keys(user_input)
-
-        move = action.get('move')
-        exit_game = action.get('exit_game')
-        select_hand = action.get('select_hand')
-        drop_item = action.get('drop_item')
-        pickup_item = action.get('pickup_item')
-        shuffle_rooms = action.get('shuffle_rooms')
-
-        player_turn_results = []
-
-        if shuffle_rooms:
-            message = game_map.shuffle_rooms(player, entities)
-            message_log.add_message(message)
-            fov_recompute = True
-
-        # TODO at the moment these functions are doing all the leg work and player_turn_results isn't used. Rectify.
-
-        if select_hand and game_state == GameStates.PLAYER_TURN:
-            player.fighter.selected_hand = select_hand
-            fov_recompute = True
-
-        if drop_item and game_state == GameStates.PLAYER_TURN:
-            message = player.fighter.drop_item(game_map, entities)
-            message_log.add_message(message)
-            game_state = GameStates.ENEMY_TURN
-            fov_recompute = True
-
-        if pickup_item and game_state == GameStates.PLAYER_TURN:
-            message = player.fighter.pickup_item(entities)
-            message_log.add_message(message)
-            game_state = GameStates.ENEMY_TURN
-            fov_recompute = True
-
-        if move and game_state == GameStates.PLAYER_TURN:
-            dx, dy = move
-            destination_room_x = player.room_x + dx
-            destination_room_y = player.room_y + dy
-
-            if destination_room_x < 0:
-                dx = 0
-
-                if player.map_x - 1 < 0:
-                    player.map_x = map_width - 1
-                else:
-                    player.map_x -= 1
-
-                player.room_x = room_width - 1
-
-            if destination_room_x == room_width:
-                destination_room_x -= 1
-                dx = 0
-
-                if player.map_x + 1 > map_width - 1:
-                    player.map_x = 0
-                else:
-                    player.map_x += 1
-
-                player.room_x = 0
-
-            if destination_room_y < 0:
-                dy = 0
+        if user_input:
+            session.stop_travel()  # Any key press stops auto-travel.
+            action = handle_keys(user_input)
 
-                if player.map_y - 1 < 0:
-                    player.map_y = map_height - 1
-                else:
-                    player.map_y -= 1
-
-                player.room_y = room_height - 1
-
-            if destination_room_y == room_height:
-                destination_room_y -= 1
-                dy = 0
-
-                if player.map_y + 1 > map_height - 1:
-                    player.map_y = 0
-                else:
-                    player.map_y += 1
-
-                player.room_y = 0
-
-            if game_map.rooms[player.map_x][player.map_y].walkable[destination_room_x, destination_room_y]:
-                target = get_blocking_entities_at_location(entities, player.map_x, player.map_y, destination_room_x, destination_room_y)
-
-                if target:  # Combat here
-                    attack_results = player.fighter.attack(target)
-                    player_turn_results.extend(attack_results)  # Add the result of the last turn to the list
-                    fov_recompute = True
-
-                else:
-                    player.move(dx, dy)  # Or just move
-                    player.set_current_room(game_map)
-
-                    # TODO: Bug with the new room layouts - some cause change of room to break.
-                    print("MapPos: ", player.map_x, ",", player.map_y, end=" / ")
-                    print("RoomPos: ", player.room_x, ",", player.room_y)
-                    fov_recompute = True
+        else:
+            action = session.get_travel_action()  # Keep auto-travelling until there, or something comes into view.
+
+            if not action:
+                continue
+
+        scroll_log = action.get('scroll_log')
+        picking_room = minimap.visible and action.get('move')
+
+        # These only change the screen, not the game, so they never reach the session or its recording.
+        if scroll_log or action.get('toggle_minimap') or action.get('travel') or picking_room:
+            if action.get('toggle_minimap'):
+                minimap.toggle(session.player)
+                minimap.invalidate()
+                render_state.invalidate()
+            elif action.get('move'):  # With the minimap up, movement keys move its cursor...
+                minimap.move_cursor(*action['move'], session.game_map)
+            elif action.get('travel') and minimap.visible:  # ...and travel sets off for the room under it.
+                message_log.add_message(session.start_travel(minimap.get_selected_room(session.game_map)))
+                minimap.toggle(session.player)
+                minimap.invalidate()
+                render_state.invalidate()
+            elif action.get('travel'):
+                message_log.add_message(Message("Open the map (m) to pick a room to travel to."))
+            elif scroll_log < 0:
+                message_log.page_up()
+            else:
+                message_log.page_down()
 
-                game_state = GameStates.ENEMY_TURN  # Switch over the enemy's turn.
+            render_all(all_consoles, session.game_map, session.entities, session.player, False, message_log, render_state, minimap)
+            tdl.flush()
+            continue
 
-        if exit_game:
+        if action.get('exit_game'):
+            if record:
+                save_recording(session.recording(), record)
             return True
 
-        for player_turn_result in player_turn_results:
-            message = player_turn_result.get("message")  # Pull any messages
-            dead_entity = player_turn_result.get("dead")  # Or anything that died
+        for turn_result in session.step(action):
+            message = turn_result.get("message")
 
             if message:
-                message_log.add_message(message)  # Add the message (if any) to the message log to print on screen.
+                message_aggregator.add(message)  # Collect the message (if any) for the message log.
 
-            if dead_entity:  # If anything died...
-                if dead_entity == player:
-                    message, game_state = kill_player(dead_entity)  # Game over
-                else:
-                    message = kill_monster(dead_entity)  # Print a death message for monster, add exp
+        message_aggregator.flush(message_log)  # The whole turn goes into the log as one update.
 
-                message_log.add_message(message)  # Print messages to screen.
-
-        player_turn_results.clear()  # Clear ready for next turn.
-
-        if game_state == GameStates.ENEMY_TURN:
-            for entity in entities:
-                if entity.map_x == player.map_x and entity.map_y == player.map_y:
-                    if entity.ai:  # If the entity has some intelligence (monsters, npc)
-                        enemy_turn_results = entity.ai.take_turn(player, game_map, entities)
-
-                        for enemy_turn_result in enemy_turn_results:  # Same deal as the player turns
-                            message = enemy_turn_result.get("message")
-                            dead_entity = enemy_turn_result.get("dead")
-
-                            if message:
-                                message_log.add_message(message)
-
-                            if dead_entity:
-                                if dead_entity == player:
-                                    message, game_state = kill_player(dead_entity)
-                                else:
-                                    message = kill_monster(dead_entity)
-
-                                message_log.add_message(message)
-
-                            if game_state == GameStates.PLAYER_DEAD:
-                                break
-
-                        enemy_turn_results.clear()
-
-                    if game_state == GameStates.PLAYER_DEAD:
-                        break
-
-            else:
-                game_state = GameStates.PLAYER_TURN
+        if action:
+            fov_recompute = True
 
 
 if __name__ == "__main__":
-    main()
+    # Pass a seed on the command line to play the same world again, e.g. python engine.py 1234
+    parser = argparse.ArgumentParser(description="7DRL 2019")
+    parser.add_argument("seed", type=int, nargs="?", default=None)
+    parser.add_argument("--pack", help="Play a level from this level pack (see map_batch.py --pack) instead of generating one.")
+    parser.add_argument("--level", type=int, default=None, help="The level to play from the pack, picked by the seed if not given.")
+    parser.add_argument("--record", metavar="PATH", help="Save a replay of the game here on exit (see benchmarks.py replay).")
+    args = parser.parse_args()
+
+    main(args.seed, args.pack, args.level, args.record)
@@ -1,18 +1,26 @@
 from render import RenderOrder
 import math
 
+# The eight tiles around an entity, as (dx, dy).
+NEIGHBOURS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
 
 class Entity:
+    # Slotted, like every entity and component class, so crowds of entities carry no per-instance __dict__.
+    __slots__ = ("current_room", "registry", "room_x", "room_y", "map_x", "map_y", "name", "char", "colour",
+                 "blocks", "render_order", "fighter", "ai")
+
     def __init__(self, game_map, room_id, room_x, room_y, name, char, colour, blocks=False, render_order=RenderOrder.CORPSE, fighter=False, ai=False):
         self.current_room = room_id
+        self.registry = None  # Set when the entity is added to an EntityRegistry.
+
+        self.room_x = room_x
+        self.room_y = room_y
 
         self.map_x = None
         self.map_y = None
         self.set_map_position(game_map)
 
-        self.room_x = room_x
-        self.room_y = room_y
-
         self.name = name
         self.char = char
         self.colour = colour
@@ -30,36 +38,43 @@ class Entity:
             self.ai.owner = self
 
     def set_map_position(self, game_map):
-        self.map_x = game_map.rooms_index[self.current_room]["map_x"]
-        self.map_y = game_map.rooms_index[self.current_room]["map_y"]
+        if self.current_room is None:  # Not in any room yet, like an item held in a hand.
+            self.map_x = None
+            self.map_y = None
+        else:
+            self.map_x = game_map.rooms_index[self.current_room]["map_x"]
+            self.map_y = game_map.rooms_index[self.current_room]["map_y"]
+        self.update_registry()
 
     def set_current_room(self, game_map):
-        for entry in game_map.rooms_index:
-            map_x = game_map.rooms_index[entry]["map_x"]
-            map_y = game_map.rooms_index[entry]["map_y"]
+        self.current_room = game_map.rooms[self.map_x][self.map_y].room_id
+        self.update_registry()
 
-            if self.map_x == map_x and self.map_y == map_y:
-                self.current_room = entry
+    def place(self, game_map, map_x, map_y, room_x, room_y):  # Put the entity on this tile of the room at map_x, map_y.
+        self.map_x = map_x
+        self.map_y = map_y
+        self.room_x = room_x
+        self.room_y = room_y
+        self.set_current_room(game_map)
+
+    def update_registry(self):
+        # Keep the registry's room and cell lookups in step with this entity's position.
+        if self.registry is not None:
+            self.registry.update(self)
 
 
 class Actor(Entity):
-    def __init__(self, game_map, room_id, room_x, room_y, name, char, colour, blocks=True, render_order=RenderOrder.ACTOR, fighter=False, ai=False):
+    __slots__ = ("speed",)
+
+    def __init__(self, game_map, room_id, room_x, room_y, name, char, colour, blocks=True, render_order=RenderOrder.ACTOR, fighter=False, ai=False, speed=100):
         super().__init__(game_map, room_id, room_x, room_y, name, char, colour, blocks=blocks, render_order=render_order, fighter=fighter, ai=ai)
+        self.speed = speed  # 100 is normal speed, 200 acts twice as often, 50 half as often.
 
     def move(self, dx, dy):
         # Move the entity by a given amount
         self.room_x += dx
         self.room_y += dy
-
-    def move_towards(self, target_map_x, target_map_y, target_room_x, target_room_y, game_map, entities):
-        path = game_map.rooms[target_map_x][target_map_y].compute_path(self.room_x, self.room_y, target_room_x, target_room_y)
-
-        dx = path[0][0] - self.room_x
-        dy = path[0][1] - self.room_y
-
-        if game_map.rooms[target_map_x][target_map_y].walkable[path[0][0], path[0][1]] \
-                and not get_blocking_entities_at_location(entities, target_map_x, target_map_y, self.room_x + dx, self.room_y + dy):
-            self.move(dx, dy)
+        self.update_registry()
 
     def distance_to(self, other):
         dx = other.room_x - self.room_x
@@ -67,16 +82,106 @@ class Actor(Entity):
         return math.sqrt(dx ** 2 + dy ** 2)
 
 
-def get_blocking_entities_at_location(entities, map_x, map_y, destination_room_x, destination_room_y):
-    for entity in entities:
-        if entity.map_x == map_x and entity.map_y == map_y:
-            if entity.blocks and entity.room_x == destination_room_x and entity.room_y == destination_room_y:
-                return entity
+def get_blocking_entities_at_location(entities, room_id, destination_room_x, destination_room_y):
+    for entity in entities.at(room_id, destination_room_x, destination_room_y):
+        if entity.blocks:
+            return entity
     return None
 
 
+class EntityRegistry:
+    """
+    The entity registry holds every entity in the game and indexes them by room id and by room cell, so that
+    "what is in this room" and "what is on this tile" are dictionary lookups rather than scans of every entity.
+    It behaves like the plain list it replaces (append, remove, iterate), and entities call update() on it
+    whenever they change room or cell.
+    Entities and room buckets are dicts keyed by id(entity), in the order entities were added, so adding, removing
+    and moving an entity never scans a list. A move within a room only re-files the entity's cell.
+    """
+    def __init__(self):
+        self.entities = {}  # id(entity) -> entity, for every entity in the game.
+        self.by_room = {}  # room_id -> {id(entity): entity} for the entities in that room.
+        self.by_cell = {}  # (room_id, room_x, room_y) -> list of entities on that tile.
+        self.keys = {}  # id(entity) -> the (room_id, room_x, room_y) the entity is currently filed under.
+
+    def __iter__(self):
+        return iter(self.entities.values())
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __contains__(self, entity):
+        return id(entity) in self.keys
+
+    def append(self, entity):
+        self.entities[id(entity)] = entity
+        entity.registry = self
+        self.add_to_index(entity)
+
+    def extend(self, entities):
+        for entity in entities:
+            self.append(entity)
+
+    def remove(self, entity):
+        self.remove_from_index(entity)
+        del self.entities[id(entity)]
+        entity.registry = None
+
+    def update(self, entity):
+        key = (entity.current_room, entity.room_x, entity.room_y)
+        old_key = self.keys.get(id(entity))
+
+        if old_key == key:
+            return
+
+        if old_key[0] != key[0]:  # Only a change of room touches the room buckets.
+            self.remove_from_room(entity, old_key[0])
+            self.by_room.setdefault(key[0], {})[id(entity)] = entity
+
+        self.remove_from_cell(entity, old_key)
+        self.by_cell.setdefault(key, []).append(entity)
+        self.keys[id(entity)] = key
+
+    def in_room(self, room_id):
+        room_entities = self.by_room.get(room_id)
+        return room_entities.values() if room_entities else ()
+
+    def at(self, room_id, room_x, room_y):
+        return self.by_cell.get((room_id, room_x, room_y), [])
+
+    def occupied_rooms(self):  # The id of every room with an entity in it, as a live view of the room index.
+        return self.by_room.keys()
+
+    def add_to_index(self, entity):
+        key = (entity.current_room, entity.room_x, entity.room_y)
+        self.keys[id(entity)] = key
+        self.by_room.setdefault(entity.current_room, {})[id(entity)] = entity
+        self.by_cell.setdefault(key, []).append(entity)
+
+    def remove_from_index(self, entity):
+        key = self.keys.pop(id(entity))
+        self.remove_from_room(entity, key[0])
+        self.remove_from_cell(entity, key)
+
+    def remove_from_room(self, entity, room_id):
+        room_entities = self.by_room[room_id]
+        del room_entities[id(entity)]
+
+        if not room_entities:
+            del self.by_room[room_id]
+
+    def remove_from_cell(self, entity, key):  # Cells hold one or two entities, so the list scan is short.
+        cell_entities = self.by_cell[key]
+        cell_entities.remove(entity)
+
+        if not cell_entities:
+            del self.by_cell[key]
+
+
 # TODO: rethink the way items are structured in the game.
 class Item(Entity):
+    __slots__ = ("weapon", "consumable")
+
     def __init__(self, game_map, room_id, room_x, room_y, name, char, colour, blocks=False, render_order=RenderOrder.ITEM, weapon=False, consumable=False):
         super().__init__(game_map, room_id, room_x, room_y, name, char, colour, blocks=blocks, render_order=render_order)
 
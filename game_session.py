@@ -0,0 +1,296 @@
+from map_system_2 import GameMap, generate_map, step_across_rooms
+from entities import Actor, Item, EntityRegistry, get_blocking_entities_at_location
+from game_states import GameStates
+from death_functions import kill_monster, kill_player
+from components import Fighter, Weapon
+from level_pack import LevelPack
+from world_simulation import WorldSimulation
+from turn_scheduler import TurnScheduler, get_action_time
+from pathfinding import PathFinder
+from message_log import Message
+import json
+import rng
+
+MAX_FOLLOW_ROOMS = 3  # Monsters give up following the player once they're this many rooms behind.
+
+
+class GameSession:
+    """
+    A game session holds the game world and runs all of the turn logic without a window. step() takes the same
+    action dicts that handle_keys produces and returns that turn's results, so the game can be driven by the tdl
+    front end in engine.py or by a script with no display at all.
+    Every run is seeded, and every action is recorded, so recording() can be replayed exactly with replay().
+    Given a level pack path, the world is loaded from one level of the pack (picked with the seed when level is
+    None) rather than generated, and the map size comes from the pack. Rooms are always ROOM_WIDTH by ROOM_HEIGHT.
+    """
+    def __init__(self, map_width=20, map_height=20, seed=None, level_pack=None, level=None):
+        if seed is None:
+            seed = rng.new_seed()
+
+        self.seed = seed
+        rng.seed(seed)
+
+        if level_pack:
+            pack = LevelPack(level_pack)
+
+            if level is None:
+                level = rng.randint(0, len(pack) - 1)
+
+            self.game_map, self.entities, self.player = pack.load_level(level)
+            self.game_map.load_room(self.player.map_x, self.player.map_y)
+
+            map_width, map_height = self.game_map.map_width, self.game_map.map_height
+
+        else:
+            self.entities = EntityRegistry()
+
+            self.game_map = GameMap(map_width, map_height)
+
+            sword_stats = Weapon(2, 10)
+            player_weapon = Item(self.game_map, None, 0, 0, "Sword", "|", (255, 255, 255), weapon=sword_stats)
+            player_stats = Fighter(hits=10, left_hand=player_weapon)
+            self.player = Actor(self.game_map, None, 15, 10, "Player", "@", (255, 255, 255), fighter=player_stats)
+            self.entities.append(self.player)
+
+            generate_map(self.game_map, self.entities, self.player)  # This also puts the player in the first room.
+
+        self.level_pack = level_pack
+        self.level = level
+
+        self.map_width = map_width
+        self.map_height = map_height
+
+        self.fov_algorithm = "BASIC"
+        self.fov_light_walls = True
+        self.fov_radius = 50
+
+        self.game_state = GameStates.PLAYER_TURN
+        self.turn_count = 0
+        self.actions = []  # Every action stepped so far, in order.
+
+        self.world = WorldSimulation()  # Keeps the rooms off screen moving.
+
+        self.scheduler = TurnScheduler()  # Decides which monsters in the player's room act, and when.
+        self.scheduler.enter_room(self.entities.in_room(self.player.current_room))
+
+        self.pathfinder = PathFinder(self.game_map)
+        self.followers = []  # Monsters that saw the player leave their room, following them into the next.
+        self.travel_destination = None  # The room_id auto-travel is heading for, if any.
+
+        self.recompute_fov()
+
+    def recompute_fov(self):  # Compute the field of view from the player's position, and explore what it shows.
+        room = self.game_map.rooms[self.player.map_x][self.player.map_y]
+        room.compute_fov(self.player.room_x, self.player.room_y,
+                         fov=self.fov_algorithm, radius=self.fov_radius, light_walls=self.fov_light_walls, sphere=True)
+        self.game_map.explore_room(room)
+
+    def step(self, action):
+        """
+        Play one action and, if it used the player's turn, the enemy turn that follows.
+        Returns a list of result dicts: "message" holds a Message, and "dead" the entity that died, if any.
+        """
+        self.actions.append(action)
+
+        move = action.get('move')
+        select_hand = action.get('select_hand')
+        drop_item = action.get('drop_item')
+        pickup_item = action.get('pickup_item')
+        shuffle_rooms = action.get('shuffle_rooms')
+
+        player_turn_results = []
+
+        if shuffle_rooms:
+            player_turn_results.append({"message": self.game_map.shuffle_rooms(self.player, self.entities)})
+
+        # TODO at the moment these functions are doing all the leg work and player_turn_results isn't used. Rectify.
+
+        if select_hand and self.game_state == GameStates.PLAYER_TURN:
+            self.player.fighter.selected_hand = select_hand
+
+        if drop_item and self.game_state == GameStates.PLAYER_TURN:
+            player_turn_results.append({"message": self.player.fighter.drop_item(self.game_map, self.entities)})
+            self.game_state = GameStates.ENEMY_TURN
+
+        if pickup_item and self.game_state == GameStates.PLAYER_TURN:
+            player_turn_results.append({"message": self.player.fighter.pickup_item(self.entities)})
+            self.game_state = GameStates.ENEMY_TURN
+
+        if move and self.game_state == GameStates.PLAYER_TURN:
+            dx, dy = move
+            player_turn_results.extend(self.move_player(dx, dy))
+
+        turn_results = self.resolve_results(player_turn_results)
+
+        if self.game_state == GameStates.ENEMY_TURN:
+            attacked = any(result.get("attacker") is self.player for result in player_turn_results)
+            turn_results.extend(self.take_enemy_turn(get_action_time(self.player, attacking=attacked)))
+            self.turn_count += 1
+            self.world.tick(self.turn_count, self.player, self.game_map, self.entities)
+
+        if action:
+            self.recompute_fov()
+
+        return turn_results
+
+    def recording(self):  # Everything needed to play this run again: the world settings, seed and actions.
+        return {"seed": self.seed, "map_width": self.map_width, "map_height": self.map_height,
+                "level_pack": self.level_pack, "level": self.level, "actions": self.actions}
+
+    def move_player(self, dx, dy):
+        results = []
+        player = self.player
+        previous_room = player.current_room
+
+        # Walking off the edge of a room takes the player into the next room over, wrapping around the map.
+        map_x, map_y, room_x, room_y = step_across_rooms(self.game_map, player.map_x, player.map_y,
+                                                         player.room_x, player.room_y, dx, dy)
+        room = self.game_map.load_room(map_x, map_y)  # Read the room's tiles if they're still on disk.
+
+        if not room.walkable[room_x, room_y]:
+            return results
+
+        if room.room_id != previous_room:  # Bring the room up to date before stepping into it.
+            self.world.catch_up(room.room_id, self.turn_count, self.game_map, self.entities)
+
+        target = get_blocking_entities_at_location(self.entities, room.room_id, room_x, room_y)
+
+        if target:  # Combat here
+            results.append({"attacker": player})
+            results.extend(player.fighter.attack(target))
+
+        else:
+            player.place(self.game_map, map_x, map_y, room_x, room_y)  # Or just move
+
+            if player.current_room != previous_room:
+                self.add_followers(previous_room)
+                self.scheduler.enter_room(self.entities.in_room(player.current_room))
+
+        self.game_state = GameStates.ENEMY_TURN  # Switch over the enemy's turn.
+
+        return results
+
+    def add_followers(self, room_id):  # The monsters in room_id that could see the player leave it follow them.
+        room_entry = self.game_map.rooms_index[room_id]
+        room = self.game_map.rooms[room_entry["map_x"]][room_entry["map_y"]]
+
+        for entity in self.entities.in_room(room_id):
+            if entity.ai and entity not in self.followers and room.fov[entity.room_x, entity.room_y]:
+                self.followers.append(entity)
+
+    def move_followers(self):
+        # Followers outside the player's room take one step along the way to it, until they arrive or fall too far behind.
+        for monster in list(self.followers):
+            if not monster.ai or monster.current_room == self.player.current_room:
+                self.followers.remove(monster)  # Dead, or already here and taking turns with the scheduler.
+                continue
+
+            route = self.pathfinder.find_route(monster.current_room, self.player.current_room)
+
+            if route is None or len(route) > MAX_FOLLOW_ROOMS:
+                self.followers.remove(monster)
+                continue
+
+            step = self.pathfinder.next_step(monster, self.player.current_room, self.entities)
+
+            if step:
+                monster.place(self.game_map, *step_across_rooms(self.game_map, monster.map_x, monster.map_y,
+                                                                monster.room_x, monster.room_y, *step))
+
+            if monster.current_room == self.player.current_room:  # Caught up, so it takes turns like the others.
+                self.followers.remove(monster)
+                self.scheduler.schedule(monster, self.scheduler.time)
+            else:
+                self.world.mark_simulated(monster.current_room, self.turn_count)  # Don't wander off while following.
+
+    def start_travel(self, room_id):  # Set off for an explored room. get_travel_action gives the moves to get there.
+        room_entry = self.game_map.rooms_index.get(room_id)
+
+        if not room_entry or not self.game_map.rooms[room_entry["map_x"]][room_entry["map_y"]].explored_count:
+            return Message("You haven't been there.")
+
+        if self.pathfinder.find_route(self.player.current_room, room_id) is None:
+            return Message("You can't find a way there.")
+
+        self.travel_destination = room_id
+        return Message("You set off.")
+
+    def stop_travel(self):
+        self.travel_destination = None
+
+    def get_travel_action(self):
+        """
+        The next move of the auto-travel started by start_travel, as an action for step(), or None once it's over:
+        the player has arrived, a monster has come into view, or the way is blocked.
+        """
+        if self.travel_destination is None:
+            return None
+
+        room = self.game_map.rooms[self.player.map_x][self.player.map_y]
+        monster_in_view = any(entity.ai and room.fov[entity.room_x, entity.room_y]
+                              for entity in self.entities.in_room(self.player.current_room))
+
+        step = None
+        if self.game_state == GameStates.PLAYER_TURN and not monster_in_view:
+            step = self.pathfinder.next_step(self.player, self.travel_destination, self.entities)
+
+        if not step:
+            self.stop_travel()
+            return None
+
+        return {'move': step}
+
+    def take_enemy_turn(self, action_time):
+        # The monsters due to act during the player's action_time take their turns, stopping if the player dies.
+        turn_results = self.resolve_results(self.scheduler.advance(action_time, self.player, self.game_map, self.entities))
+
+        if self.game_state != GameStates.PLAYER_DEAD:
+            self.move_followers()
+            self.game_state = GameStates.PLAYER_TURN
+
+        return turn_results
+
+    def resolve_results(self, results):
+        # Pass messages through, and turn anything that died into a death message (and maybe a game over).
+        resolved_results = []
+
+        for result in results:
+            message = result.get("message")
+            dead_entity = result.get("dead")
+
+            if message:
+                resolved_results.append({"message": message})
+
+            if dead_entity:
+                if dead_entity == self.player:
+                    message, self.game_state = kill_player(dead_entity)  # Game over
+                else:
+                    message = kill_monster(dead_entity)
+
+                resolved_results.append({"message": message, "dead": dead_entity})
+
+            if self.game_state == GameStates.PLAYER_DEAD:
+                break
+
+        return resolved_results
+
+
+def replay(recording):
+    # Plays a recorded run again as fast as possible, with no window. Returns the session at the end of the run.
+    session = GameSession(recording["map_width"], recording["map_height"], seed=recording["seed"],
+                          level_pack=recording.get("level_pack"), level=recording.get("level"))
+
+    for action in recording["actions"]:
+        session.step(action)
+
+    return session
+
+
+def save_recording(recording, path):
+    with open(path, "w") as recording_file:
+        json.dump(recording, recording_file)
+
+
+def load_recording(path):
+    with open(path) as recording_file:
+        return json.load(recording_file)
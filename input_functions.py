@@ -28,6 +28,15 @@ def handle_keys(user_input):
     elif user_input.key == "UP":
         return {'pickup_item': True}
 
+    elif user_input.key == "PAGEUP":
+        return {'scroll_log': -1}
+    elif user_input.key == "PAGEDOWN":
+        return {'scroll_log': 1}
+    elif key_char == 'm':
+        return {'toggle_minimap': True}
+    elif key_char == 't':
+        return {'travel': True}
+
     if user_input.key == 'ESCAPE':
         # Exit the game
         return {'exit_game': True}
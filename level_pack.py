@@ -0,0 +1,70 @@
+from save_functions import unpack_game
+import mmap
+import struct
+
+# Level pack format, all little endian:
+#
+#     header          PACK_HEADER
+#     level table     LEVEL_RECORD per level
+#     levels          one pack_game save per level, back to back
+#
+# The level table gives each level's offset and length in the file, so a level can be picked out of a memory
+# mapped pack without reading any of the others.
+
+PACK_MAGIC = b"7DLP"
+PACK_VERSION = 1
+
+PACK_HEADER = struct.Struct("<4sBI")  # magic, version, level count
+LEVEL_RECORD = struct.Struct("<QII")  # offset, length, seed the level was generated from
+
+
+class LevelPack:
+    """
+    A level pack file opened with mmap. Opening it only reads the header; load_level reads one level's room
+    table and entities, and each room's tiles are only read from the file when the player enters the room.
+    The file stays mapped while the pack is open, as the rooms of loaded levels read from it.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as pack_file:
+            self.mapped_file = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.data = memoryview(self.mapped_file)
+
+        magic, version, self.level_count = PACK_HEADER.unpack_from(self.data, 0)
+
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError("{} is not a version {} 7DRL level pack.".format(path, PACK_VERSION))
+
+    def __len__(self):
+        return self.level_count
+
+    def get_level_record(self, level):  # (offset, length, seed) for this level.
+        if not 0 <= level < self.level_count:
+            raise IndexError("Level {} is not in this pack of {} levels.".format(level, self.level_count))
+
+        return LEVEL_RECORD.unpack_from(self.data, PACK_HEADER.size + level * LEVEL_RECORD.size)
+
+    def get_level_seed(self, level):
+        return self.get_level_record(level)[2]
+
+    def load_level(self, level):  # Returns (game_map, entities, player), with every room still unloaded.
+        offset, length, seed = self.get_level_record(level)
+        return unpack_game(self.data[offset:offset + length], lazy=True)
+
+
+def write_level_pack(path, levels):
+    """
+    Writes a level pack from (seed, save) pairs, where each save is the bytes pack_game returned for that level.
+    """
+    offset = PACK_HEADER.size + LEVEL_RECORD.size * len(levels)
+
+    with open(path, "wb") as pack_file:
+        pack_file.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(levels)))
+
+        for seed, save in levels:
+            pack_file.write(LEVEL_RECORD.pack(offset, len(save), seed))
+            offset += len(save)
+
+        for seed, save in levels:
+            pack_file.write(save)
+
@@ -0,0 +1,145 @@
+from concurrent.futures import ProcessPoolExecutor
+from map_system_2 import GameMap, generate_map
+from entities import Actor, EntityRegistry
+from game_session import GameSession
+from save_functions import pack_game
+from level_pack import write_level_pack
+import argparse
+import json
+import random
+import rng
+import time
+
+
+def get_job_seeds(base_seed, count):
+    # Each job's seed depends only on the base seed and the job's position, never on which worker runs it.
+    seed_stream = random.Random(base_seed)
+    return [seed_stream.randrange(2 ** 32) for i in range(count)]
+
+
+def create_map(seed, map_width, map_height):  # A freshly generated map, and the player standing in its first room.
+    rng.seed(seed)
+
+    game_map = GameMap(map_width, map_height)
+    entities = EntityRegistry()
+
+    player = Actor(game_map, None, 15, 10, "Player", "@", (255, 255, 255))
+    entities.append(player)
+
+    generate_map(game_map, entities, player)
+
+    return game_map, player
+
+
+def generate_map_job(job):
+    seed, map_width, map_height = job
+    game_map, player = create_map(seed, map_width, map_height)
+
+    return summarise_map(game_map, seed, player.current_room)
+
+
+def validate_map_job(job):
+    # Generates a map and checks it with the room graph, returning what's wrong with it (if anything) by seed.
+    seed, map_width, map_height = job
+    game_map, player = create_map(seed, map_width, map_height)
+
+    problems = game_map.room_graph.validate(player.current_room)
+    problems["seed"] = seed
+    problems["rooms"] = len(game_map.rooms_index)
+    problems["components"] = len(game_map.room_graph.components())
+
+    return problems
+
+
+def summarise_validation(results):  # Totals over a batch of validate_map_job results.
+    summary = {"maps": len(results), "invalid_maps": 0, "rooms": 0,
+               "unreachable_rooms": 0, "dangling_exits": 0, "missing_main_area": 0}
+
+    for result in results:
+        problem_counts = [len(result[problem]) for problem in ("unreachable_rooms", "dangling_exits", "missing_main_area")]
+
+        summary["rooms"] += result["rooms"]
+        summary["unreachable_rooms"] += problem_counts[0]
+        summary["dangling_exits"] += problem_counts[1]
+        summary["missing_main_area"] += problem_counts[2]
+
+        if any(problem_counts):
+            summary["invalid_maps"] += 1
+
+    return summary
+
+
+def pack_level_job(job):
+    # A whole starting world, player and monsters included, as one level of a level pack.
+    seed, map_width, map_height = job
+
+    session = GameSession(map_width, map_height, seed=seed)
+
+    return seed, pack_game(session.game_map, session.entities, session.player)
+
+
+def summarise_map(game_map, seed, start_room):
+    """
+    A generated map as plain tuples and ints, small enough to send back from a worker and to write out as JSON.
+    Each room is (room_id, map_x, map_y, exit_flags, branch_level) - everything generation decides about it.
+    """
+    rooms = []
+
+    for room_id, entry in game_map.rooms_index.items():
+        room = game_map.rooms[entry["map_x"]][entry["map_y"]]
+        rooms.append((room_id, entry["map_x"], entry["map_y"], room.room_layout.get_exit_flags(), room.branch_level))
+
+    return {"seed": seed, "map_width": game_map.map_width, "map_height": game_map.map_height,
+            "start_room": start_room, "rooms": rooms}
+
+
+def generate_maps(count, base_seed=0, map_width=20, map_height=20, workers=None, job_function=generate_map_job):
+    """
+    Generates count maps, one per job, across a pool of worker processes (workers=None uses every CPU, and
+    workers=1 runs in this process). The results are in job order and identical whatever the number of workers.
+    job_function turns each (seed, map_width, map_height) job into a result: a summary by default, a level with
+    pack_level_job, or a list of the map's problems with validate_map_job.
+    """
+    jobs = [(seed, map_width, map_height) for seed in get_job_seeds(base_seed, count)]
+
+    if workers == 1:
+        return [job_function(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(job_function, jobs, chunksize=max(1, count // 64)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a batch of maps in parallel.")
+    parser.add_argument("--maps", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0, help="Base seed the per-map seeds are drawn from.")
+    parser.add_argument("--size", type=int, default=20, help="Map width and height.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU).")
+    parser.add_argument("--output", help="Write the maps to this file as JSON lines.")
+    parser.add_argument("--pack", help="Write the maps to this file as a level pack for engine.py --pack.")
+    parser.add_argument("--validate", action="store_true", help="Check every map's rooms connect up, and report totals.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.validate:
+        job_function = validate_map_job
+    elif args.pack:
+        job_function = pack_level_job
+    else:
+        job_function = generate_map_job
+
+    maps = generate_maps(args.maps, args.seed, args.size, args.size, args.workers, job_function=job_function)
+    elapsed = time.perf_counter() - start
+
+    if args.validate:
+        print(summarise_validation(maps))
+
+    elif args.pack:
+        write_level_pack(args.pack, maps)
+
+    elif args.output:
+        with open(args.output, "w") as output_file:
+            for generated_map in maps:
+                output_file.write(json.dumps(generated_map) + "\n")
+
+    print("Generated {0} maps in {1:.2f} s ({2:.0f} maps per second)".format(len(maps), elapsed, len(maps) / elapsed))
@@ -1,6 +1,6 @@
 from tdl.map import Map
 from collections import namedtuple
-from random import choice, shuffle, randint
+from rng import choice, shuffle, randint
 from copy import deepcopy
 from message_log import Message
 from enum import Enum
@@ -230,15 +230,16 @@ def place_entities(game_map, room, entities, max_monsters_per_room, max_items_pe
 
 
 def pick_monster(game_map, room_id, room_x, room_y, monster_template):
-        name, char, colour, hits, weapon = monster_template
+        name, char, colour, hits, weapon, speed = monster_template
 
-        weapon_name, weapon_char, weapon_colour, weapon_power, weapon_uses = weapon
+        weapon_name, weapon_char, weapon_colour, weapon_power, weapon_uses, weapon_speed = weapon
 
-        weapon_stats = Weapon(weapon_power, weapon_uses)
+        weapon_stats = Weapon(weapon_power, weapon_uses, weapon_speed)
         monster_weapon = Item(game_map, room_id, room_x, room_y, weapon_name, weapon_char, weapon_colour, weapon=weapon_stats)
 
         fighter_component = Fighter(hits, left_hand=monster_weapon)
         ai_component = BasicMonster()
-        monster = Actor(game_map, room_id, room_x, room_y, name, char, colour, fighter=fighter_component, ai=ai_component)
+        monster = Actor(game_map, room_id, room_x, room_y, name, char, colour, fighter=fighter_component, ai=ai_component,
+                        speed=speed)
 
         return monster
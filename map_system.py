@@ -1,12 +1,12 @@
 from tdl.map import Map
 from collections import namedtuple
-from random import choice, shuffle, randint
-from copy import deepcopy
+from rng import choice, shuffle, randint
 from message_log import Message
 from enum import Enum
 from entities import Actor, Item
 from components import Fighter, BasicMonster, Weapon
 from templates import monsters_list
+import numpy
 
 # Colours
 colours = namedtuple("colours", ["light_wall", "dark_wall", "light_ground", "dark_ground"])
@@ -70,6 +70,14 @@ class RoomComponent:
             self.create = self.rect.fill_rect
 
 
+# The shared components every layout is built from - they never change, so they're only made once.
+NORTH_EXIT = RoomComponent(4, 0, 22, 4)
+EAST_EXIT = RoomComponent(26, 4, 4, 22)
+SOUTH_EXIT = RoomComponent(4, 26, 22, 4)
+WEST_EXIT = RoomComponent(0, 4, 4, 22)
+MAIN_AREA = RoomComponent(4, 4, 22, 22)
+
+
 class RoomLayout:
     """
     The room layout is a holding class for multiple room components.
@@ -87,6 +95,12 @@ class RoomLayout:
         self.coordinates = self.main_area.coordinates
         self.components = self.register_components()
 
+        # Every walkable tile of the layout as one mask, so it can be laid into a room in a single copy.
+        self.mask = numpy.zeros((30, 30), dtype=bool)
+        for component in self.components:
+            self.mask[component.rect.x1:component.rect.x2, component.rect.y1:component.rect.y2] = True
+        self.mask.setflags(write=False)
+
     def register_components(self):
         components = []
 
@@ -109,8 +123,8 @@ class RoomLayout:
 
     def create_layout_in_room(self, room):
         room.coordinates = self.coordinates
-        for component in self.components:
-            component.create(room)
+        room.walkable[self.mask] = True
+        room.transparent[self.mask] = True
 
 
 class Schema(Enum):
@@ -134,14 +148,19 @@ class Schema(Enum):
     WEST_DEAD = 14
 
 
-# Takes the Schema ENUM value and returns a RoomLayout object of that type. This is used as a component for a room obj.
+# Takes the Schema ENUM value and returns the RoomLayout object of that type. This is used as a component for a room obj.
+# The layouts are all built once, in SCHEMA_LAYOUTS, and shared between rooms.
 def create_room_layout(schema):
-    north_exit = RoomComponent(4, 0, 22, 4)
-    east_exit = RoomComponent(26, 4, 4, 22)
-    south_exit = RoomComponent(4, 26, 22, 4)
-    west_exit = RoomComponent(0, 4, 4, 22)
+    return SCHEMA_LAYOUTS.get(schema)
+
 
-    main_area = RoomComponent(4, 4, 22, 22)
+def build_room_layout(schema):
+    north_exit = NORTH_EXIT
+    east_exit = EAST_EXIT
+    south_exit = SOUTH_EXIT
+    west_exit = WEST_EXIT
+
+    main_area = MAIN_AREA
 
     if schema == Schema.FOUR_WAY:
         room_layout = RoomLayout(main_area=main_area,
@@ -224,6 +243,9 @@ def create_room_layout(schema):
     return room_layout
 
 
+SCHEMA_LAYOUTS = {schema: build_room_layout(schema) for schema in Schema}
+
+
 class GameMap:
     def __init__(self, map_width, map_height):
         self.map_width = map_width
@@ -239,35 +261,21 @@ class GameMap:
             for x in range(self.map_width):
                 self.rooms_index[self.rooms[x][y].room_id] = {"map_x": x, "map_y": y}
 
-    # This moves the rooms around the map.
+    # This moves the rooms around the map by permuting room references - no room is ever copied.
     def shuffle_rooms(self, player, entities):
-        viable_coordinates = []
-
-        # Append an x,y for each location in the game map.
-        for y in range(self.map_height):
-            for x in range(self.map_width):
-                viable_coordinates.append((x, y))
-
-        # Remove the player's current location or things could get messy. Shuffle the list.
-        viable_coordinates.remove((player.map_x, player.map_y))
+        # Every location in the game map except the player's current location or things could get messy.
+        viable_coordinates = [(x, y) for y in range(self.map_height) for x in range(self.map_width)
+                              if x != player.map_x or y != player.map_y]
         shuffle(viable_coordinates)
 
-        # This avoids leaving one room copied and not replaced, ending up with a duplicate.
-        final_copy_x, final_copy_y = viable_coordinates[0]
-        final_copied_room = deepcopy(self.rooms[final_copy_x][final_copy_y])
-
-        # Pop the first room coords, and set that to be replaced by the next room in the list. Continue in this way.
-        while len(viable_coordinates) > 1:
-            replace_x, replace_y = viable_coordinates.pop(0)
-            copy_x, copy_y = viable_coordinates[0]
-            copied_room = deepcopy(self.rooms[copy_x][copy_y])
-            self.rooms[replace_x][replace_y] = copied_room
-
-        # There will always be one room left because of this method, so that's why we copied before the while loop
-        final_replace_x, final_replace_y = viable_coordinates.pop(0)
-        self.rooms[final_replace_x][final_replace_y] = final_copied_room
+        # Each location takes the room from the next location in the list, and the last takes the first.
+        shuffled_rooms = [self.rooms[x][y] for x, y in viable_coordinates]
+        shuffled_rooms = shuffled_rooms[1:] + shuffled_rooms[:1]
 
-        self.update_rooms_index()  # Update the room index with the new positions.
+        for (x, y), room in zip(viable_coordinates, shuffled_rooms):
+            self.rooms[x][y] = room
+            self.rooms_index[room.room_id]["map_x"] = x  # Update the room index in place with the new position.
+            self.rooms_index[room.room_id]["map_y"] = y
 
         message = Message("You feel an odd sensation of movement...")
 
@@ -383,7 +391,7 @@ def place_entities(game_map, room, entities, max_monsters_per_room, max_items_pe
     for i in range(randint(1, max_monsters_per_room)):
         room_x, room_y = choice(room.coordinates)
 
-        if not any([entity for entity in entities if entity.current_room == room.room_id and entity.room_x == room_x and entity.room_y == room_y]):
+        if not entities.at(room.room_id, room_x, room_y):
             monster_template = choice(monsters_list)
             monster = pick_monster(game_map, room.room_id, room_x, room_y, monster_template)
             entities.append(monster)  # This is that list from engine with just the player in it.
@@ -399,15 +407,16 @@ def place_entities(game_map, room, entities, max_monsters_per_room, max_items_pe
 
 
 def pick_monster(game_map, room_id, room_x, room_y, monster_template):
-    name, char, colour, hits, weapon = monster_template
+    name, char, colour, hits, weapon, speed = monster_template
 
-    weapon_name, weapon_char, weapon_colour, weapon_power, weapon_uses = weapon
+    weapon_name, weapon_char, weapon_colour, weapon_power, weapon_uses, weapon_speed = weapon
 
-    weapon_stats = Weapon(weapon_power, weapon_uses)
+    weapon_stats = Weapon(weapon_power, weapon_uses, weapon_speed)
     monster_weapon = Item(game_map, room_id, room_x, room_y, weapon_name, weapon_char, weapon_colour, weapon=weapon_stats)
 
     fighter_component = Fighter(hits, left_hand=monster_weapon)
     ai_component = BasicMonster()
-    monster = Actor(game_map, room_id, room_x, room_y, name, char, colour, fighter=fighter_component, ai=ai_component)
+    monster = Actor(game_map, room_id, room_x, room_y, name, char, colour, fighter=fighter_component, ai=ai_component,
+                    speed=speed)
 
     return monster
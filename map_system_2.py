@@ -1,17 +1,20 @@
 from tdl.map import Map
-from collections import namedtuple
+from collections import namedtuple, deque
 from enum import Enum
+from message_log import Message
 from entities import Actor, Item
 from components import Fighter, BasicMonster, Weapon
 from templates import monsters_list
-import random
+from rng import choice, shuffle, randint
+import numpy
+import math
 
-PRNG = random.Random()
-seed = random.Random()
-PRNG.seed(seed)
-choice = PRNG.choice
-shuffle = PRNG.shuffle
-randint = PRNG.randint
+ROOM_WIDTH = 30  # Every room is this size, so room components and schematics can be precompiled for it.
+ROOM_HEIGHT = 30
+
+FOV_CACHE_SIZE = 256  # Maximum number of FOV results remembered per room before the cache is emptied.
+UNREACHABLE = 2 ** 30  # Flow field distance for tiles that cannot reach the target.
+LOOP_FRACTION = 0.25  # How many of the places two branches could be joined into a loop actually get joined.
 
 # Colours
 colours = namedtuple("colours", ["light_wall", "dark_wall", "light_ground", "dark_ground"])
@@ -21,6 +24,8 @@ blue = colours((65, 125, 250), (35, 75, 160), (30, 60, 110), (10, 20, 40))
 green = colours((0, 250, 0), (0, 160, 0), (0, 110, 0), (0, 40, 0))
 yellow = colours((250, 180, 0), (160, 110, 0), (110, 70, 0), (40, 10, 0))
 
+room_colours = [white, red, blue, green, yellow]  # Every room colour scheme, in a fixed order for save files.
+
 
 class RoomComponentTypes(Enum):
     main_area = 0
@@ -30,6 +35,11 @@ class RoomComponentTypes(Enum):
     east_exit = 4
 
 
+# One bit per exit, for storing a room's exits compactly.
+EXIT_FLAGS = {RoomComponentTypes.north_exit: 1, RoomComponentTypes.east_exit: 2,
+              RoomComponentTypes.south_exit: 4, RoomComponentTypes.west_exit: 8}
+
+
 class Schematic(Enum):
     """
     This contains static variables to delimit each possible room schematic.
@@ -51,6 +61,26 @@ class Schematic(Enum):
     WEST_DEAD = 14
 
 
+# The exits each schematic has, as EXIT_FLAGS bits (north 1, east 2, south 4, west 8).
+SCHEMATIC_EXITS = {Schematic.FOUR_WAY: 1 | 2 | 4 | 8,
+                   Schematic.NORTH_TEE: 1 | 2 | 8,
+                   Schematic.EAST_TEE: 1 | 2 | 4,
+                   Schematic.SOUTH_TEE: 2 | 4 | 8,
+                   Schematic.WEST_TEE: 1 | 4 | 8,
+                   Schematic.NORTH_SOUTH_TUNNEL: 1 | 4,
+                   Schematic.WEST_EAST_TUNNEL: 2 | 8,
+                   Schematic.NORTH_EAST_CORNER: 1 | 2,
+                   Schematic.NORTH_WEST_CORNER: 1 | 8,
+                   Schematic.SOUTH_EAST_CORNER: 2 | 4,
+                   Schematic.SOUTH_WEST_CORNER: 4 | 8,
+                   Schematic.NORTH_DEAD: 1,
+                   Schematic.EAST_DEAD: 2,
+                   Schematic.SOUTH_DEAD: 4,
+                   Schematic.WEST_DEAD: 8}
+
+SCHEMATICS_BY_EXITS = {exit_flags: schematic for schematic, exit_flags in SCHEMATIC_EXITS.items()}
+
+
 class Rect:
     """
     Rect class takes an initial x,y coordinate as the top left of a rectangle, and using width and height
@@ -62,67 +92,53 @@ class Rect:
         self.x2 = self.x1 + rect_width
         self.y2 = self.y1 + rect_height
 
-    def carve_rect(self, room):  # Create a walkable area in the room object the shape of this Rect, return coords.
-        carved_coordinates = []
-        for x in range(self.x1, self.x2):
-            for y in range(self.y1, self.y2):
-                room.walkable[x, y] = True
-                room.transparent[x, y] = True
-                carved_coordinates.append((x, y))
-        return carved_coordinates
-
-    def fill_rect(self, room):  # Create a solid area in the room object the shape of this Rect, return coords.
-        filled_coordinates = []
-        for x in range(self.x1, self.x2):
-            for y in range(self.y1, self.y2):
-                room.walkable[x, y] = False
-                room.transparent[x, y] = False
-                filled_coordinates.append((x, y))
-        return filled_coordinates
-
-    def ghost_rect(self):  # Only coordinates returned, no interaction with room object.
-        coordinates = []
-        for x in range(self.x1, self.x2):
-            for y in range(self.y1, self.y2):
-                coordinates.append((x, y))
-        return coordinates
-
 
 class RoomComponent:
     """
-    A room component is a unit which stores it's coordinates, and can create itself in a room.
-    In practice this could be either a walkable area or a blocked off area.
-    This is usually either the main room, an exit location, or walls inside a room.
+    A room component is a unit which stores it's coordinates as a read-only mask over the room.
+    This is either the main room or an exit location. Components never change, so they are shared between rooms,
+    and lay_out_room carves them all at once through the room's schematic mask.
     """
     def __init__(self, x, y, w, h, walkable=True):
         self.rect = Rect(x, y, w, h)
-        self.coordinates = self.rect.ghost_rect()
+        self.walkable = walkable
 
-        if walkable:
-            self.create = self.rect.carve_rect
-        else:
-            self.create = self.rect.fill_rect
+        self.mask = numpy.zeros((ROOM_WIDTH, ROOM_HEIGHT), dtype=bool)
+        self.mask[self.rect.x1:self.rect.x2, self.rect.y1:self.rect.y2] = True
+        self.mask.setflags(write=False)
+
+
+# One shared, precompiled component of each type. Components never change once made, so every room uses these.
+ROOM_COMPONENTS = {RoomComponentTypes.main_area: RoomComponent(4, 4, 22, 22, walkable=True),
+                   RoomComponentTypes.north_exit: RoomComponent(4, 0, 22, 4, walkable=True),
+                   RoomComponentTypes.east_exit: RoomComponent(26, 4, 4, 22, walkable=True),
+                   RoomComponentTypes.south_exit: RoomComponent(4, 26, 22, 4, walkable=True),
+                   RoomComponentTypes.west_exit: RoomComponent(0, 4, 4, 22, walkable=True)}
 
 
 def create_room_component(component_type):
-    if component_type == RoomComponentTypes.main_area:
-        room_component = RoomComponent(4, 4, 22, 22, walkable=True)
+    return ROOM_COMPONENTS[component_type]
 
-    elif component_type == RoomComponentTypes.north_exit:
-        room_component = RoomComponent(4, 0, 22, 4, walkable=True)
 
-    elif component_type == RoomComponentTypes.east_exit:
-        room_component = RoomComponent(26, 4, 4, 22, walkable=True)
+def create_schematic_mask(exit_flags):  # The main area and the given exits, as one read-only mask.
+    mask = ROOM_COMPONENTS[RoomComponentTypes.main_area].mask.copy()
 
-    elif component_type == RoomComponentTypes.south_exit:
-        room_component = RoomComponent(4, 26, 22, 4, walkable=True)
+    for component_type, exit_flag in EXIT_FLAGS.items():
+        if exit_flags & exit_flag:
+            mask |= ROOM_COMPONENTS[component_type].mask
 
-    elif component_type == RoomComponentTypes.west_exit:
-        room_component = RoomComponent(0, 4, 4, 22, walkable=True)
-    else:
-        room_component = RoomComponent(0, 0, 0, 0, walkable=False)
+    mask.setflags(write=False)
+    return mask
+
+
+# Every schematic's walkable tiles, precompiled once, so a whole room can be laid out with one copy.
+# A room with no exits yet has no schematic, so None is just the main area.
+SCHEMATIC_MASKS = {schematic: create_schematic_mask(exit_flags) for schematic, exit_flags in SCHEMATIC_EXITS.items()}
+SCHEMATIC_MASKS[None] = create_schematic_mask(0)
 
-    return room_component
+# And each schematic's walkable tiles as (x, y) tuples, for picking spawn points without searching the room.
+SCHEMATIC_CELLS = {schematic: tuple(map(tuple, numpy.argwhere(mask).tolist()))
+                   for schematic, mask in SCHEMATIC_MASKS.items()}
 
 
 class RoomLayout:
@@ -139,41 +155,280 @@ class RoomLayout:
         self.east_exit = east_exit
         self.main_area = main_area
 
+    def get_exit_flags(self):  # The exits in this layout packed into one int, see EXIT_FLAGS.
+        exit_flags = 0
+
+        if self.north_exit:
+            exit_flags |= EXIT_FLAGS[RoomComponentTypes.north_exit]
+        if self.east_exit:
+            exit_flags |= EXIT_FLAGS[RoomComponentTypes.east_exit]
+        if self.south_exit:
+            exit_flags |= EXIT_FLAGS[RoomComponentTypes.south_exit]
+        if self.west_exit:
+            exit_flags |= EXIT_FLAGS[RoomComponentTypes.west_exit]
+
+        return exit_flags
+
+
+# The step across the map that each exit leads to.
+EXIT_DIRECTIONS = {RoomComponentTypes.north_exit: (0, -1), RoomComponentTypes.east_exit: (1, 0),
+                   RoomComponentTypes.south_exit: (0, 1), RoomComponentTypes.west_exit: (-1, 0)}
+
+
+class RoomGraph:
+    """
+    The room graph knows which rooms lead to which. Its nodes are the rooms in the rooms index, and its edges are
+    matching pairs of exits - an east exit opening onto a west exit in the room next door, wrapping around the edges
+    of the map like validate_coords. An exit opening onto anything else is dangling and leads nowhere.
+    Connected rooms share a set in a union-find forest, so asking whether one room can reach another is close to
+    constant time, and routes between rooms are found breadth first over the edges.
+    Call rebuild() after anything that moves rooms or changes their exits (generate_map and shuffle_rooms do);
+    version goes up with every rebuild so anything worked out from the graph knows when it's out of date.
+    """
+    def __init__(self, game_map):
+        self.game_map = game_map
+
+        self.exits = {}  # room_id -> {exit type: room_id of the room it leads to}
+        self.dangling_exits = []  # (room_id, exit type) of every exit without a matching exit on the other side.
+
+        self.parents = {}  # The union-find forest: room_id -> its parent room_id.
+        self.sizes = {}  # Root room_id -> how many rooms are in its set.
+
+        self.version = 0
+
+    def rebuild(self):
+        game_map = self.game_map
+        positions = {}
+        exit_flags = {}
+
+        for room_id, entry in game_map.rooms_index.items():
+            positions[(entry["map_x"], entry["map_y"])] = room_id
+            exit_flags[room_id] = game_map.rooms[entry["map_x"]][entry["map_y"]].room_layout.get_exit_flags()
+
+        self.exits = {}
+        self.dangling_exits = []
+        self.parents = {room_id: room_id for room_id in exit_flags}
+        self.sizes = {room_id: 1 for room_id in exit_flags}
+
+        for (map_x, map_y), room_id in positions.items():
+            room_exits = {}
+
+            for exit_type, (dx, dy) in EXIT_DIRECTIONS.items():
+                if not exit_flags[room_id] & EXIT_FLAGS[exit_type]:
+                    continue
+
+                neighbour_position = validate_coords(map_x, map_y, dx, dy, game_map.map_width, game_map.map_height)
+                neighbour_id = positions.get(neighbour_position)
+
+                if neighbour_id is not None and exit_flags[neighbour_id] & EXIT_FLAGS[get_opposite_exit(exit_type)]:
+                    room_exits[exit_type] = neighbour_id
+                    self.union(room_id, neighbour_id)
+                else:
+                    self.dangling_exits.append((room_id, exit_type))
+
+            self.exits[room_id] = room_exits
+
+        self.version += 1
+
+    def find(self, room_id):  # The room standing for room_id's whole connected set.
+        parents = self.parents
+
+        while parents[room_id] != room_id:
+            parents[room_id] = parents[parents[room_id]]  # Halve the path on the way up, so later finds are shorter.
+            room_id = parents[room_id]
+
+        return room_id
+
+    def union(self, room_id, other_room_id):
+        root = self.find(room_id)
+        other_root = self.find(other_room_id)
+
+        if root == other_root:
+            return
+
+        if self.sizes[root] < self.sizes[other_root]:  # Hang the smaller set under the bigger one.
+            root, other_root = other_root, root
+
+        self.parents[other_root] = root
+        self.sizes[root] += self.sizes.pop(other_root)
+
+    def is_reachable(self, room_id, other_room_id):
+        return self.find(room_id) == self.find(other_room_id)
+
+    def component_size(self, room_id):  # How many rooms can be reached from this one, itself included.
+        return self.sizes[self.find(room_id)]
+
+    def components(self):  # Every connected set of rooms, as lists of room_ids, biggest first.
+        components = {}
+
+        for room_id in self.parents:
+            components.setdefault(self.find(room_id), []).append(room_id)
+
+        return sorted(components.values(), key=len, reverse=True)
+
+    def find_route(self, start_room, goal_room):
+        # The shortest list of room_ids leading from start_room to goal_room, both included, or None if there's no way.
+        if not self.is_reachable(start_room, goal_room):
+            return None
+
+        came_from = {start_room: None}
+        frontier = deque([start_room])
+
+        while frontier:
+            room_id = frontier.popleft()
+
+            if room_id == goal_room:
+                break
+
+            for neighbour_id in self.exits[room_id].values():
+                if neighbour_id not in came_from:
+                    came_from[neighbour_id] = room_id
+                    frontier.append(neighbour_id)
+
+        route = []
+        room_id = goal_room
+        while room_id is not None:
+            route.append(room_id)
+            room_id = came_from[room_id]
+
+        return route[::-1]
+
+    def validate(self, start_room):
+        """
+        Checks the map for the problems generation can leave behind: rooms that can't be reached from start_room,
+        exits leading nowhere, and rooms whose main area was never carved (rooms still on disk are skipped).
+        Returns them as lists in a dict, all empty for a sound map.
+        """
+        main_area = ROOM_COMPONENTS[RoomComponentTypes.main_area].mask
+        missing_main_area = []
+
+        for room in self.game_map.materialised_rooms():
+            if isinstance(room, Room) and not room.walkable[main_area].all():
+                missing_main_area.append(room.room_id)
+
+        return {"unreachable_rooms": [room_id for room_id in self.parents if not self.is_reachable(start_room, room_id)],
+                "dangling_exits": [(room_id, exit_type.name) for room_id, exit_type in self.dangling_exits],
+                "missing_main_area": missing_main_area}
+
 
 class GameMap:
+    """
+    The game map is a grid of rooms. Rooms are only allocated when generation carves them, so every other cell
+    of the grid holds the shared EMPTY_ROOM sentinel, and rooms_index only lists rooms that really exist.
+    """
     def __init__(self, map_width, map_height):
         self.map_width = map_width
         self.map_height = map_height
         self.rooms = self.initialise_rooms()
 
         self.rooms_index = {}  # This is a dictionary to keep track of where each room is in the GameMap object.
-        self.update_rooms_index()
+        self.room_graph = RoomGraph(self)  # Which rooms lead to which - rebuild it whenever rooms move.
 
-        self.create_room_layouts()
+        # Map-wide exploration totals, kept up to date by explore_room so they never need counting.
+        self.explored_cells = 0
+        self.rooms_explored = 0
 
     def initialise_rooms(self):
-        rooms = [[Room(30, 30, room_id=str(map_x) + "x" + str(map_y), room_layout=False)
-                  for map_y in range(self.map_height)] for map_x in range(self.map_width)]
+        rooms = [[EMPTY_ROOM for map_y in range(self.map_height)] for map_x in range(self.map_width)]
 
         return rooms
 
-    def update_rooms_index(self):
-        for y in range(self.map_height):
-            for x in range(self.map_width):
-                self.rooms_index[self.rooms[x][y].room_id] = {"map_x": x, "map_y": y, "room_layout": None}
+    def materialise_room(self, map_x, map_y):  # Returns the room at this position, allocating it if it's empty.
+        room = self.rooms[map_x][map_y]
 
-    def create_room_layouts(self):
-        for y in range(self.map_height):
-            for x in range(self.map_width):
-                self.rooms_index[self.rooms[x][y].room_id]["room_layout"] = RoomLayout(create_room_component(RoomComponentTypes.main_area))
-                self.rooms[x][y].room_layout = self.rooms_index[self.rooms[x][y].room_id]["room_layout"]
+        if room is EMPTY_ROOM:
+            room_layout = RoomLayout(create_room_component(RoomComponentTypes.main_area))
+            room = Room(ROOM_WIDTH, ROOM_HEIGHT, room_id=str(map_x) + "x" + str(map_y), room_layout=room_layout)
+            self.add_room(room, map_x, map_y)
+
+        return room
+
+    def add_room(self, room, map_x, map_y):  # Put an allocated room into the map and the rooms index.
+        if room.room_id not in self.rooms_index and room.explored_count:  # A room loaded already part explored.
+            self.explored_cells += room.explored_count
+            self.rooms_explored += 1
+
+        self.rooms[map_x][map_y] = room
+        self.rooms_index[room.room_id] = {"map_x": map_x, "map_y": map_y, "room_layout": room.room_layout}
+
+    def load_room(self, map_x, map_y):  # Returns the room here, reading its tiles first if they haven't been yet.
+        room = self.rooms[map_x][map_y]
+
+        if isinstance(room, UnloadedRoom):
+            room = room.load()
+            self.add_room(room, map_x, map_y)
+
+        return room
+
+    def materialised_rooms(self):  # Every room that has been allocated, wherever it is in the map now.
+        for entry in self.rooms_index.values():
+            yield self.rooms[entry["map_x"]][entry["map_y"]]
+
+    # This moves the rooms around the map by permuting room references - no room is ever copied.
+    def shuffle_rooms(self, player, entities):
+        # Every location in the game map except the player's current location or things could get messy.
+        viable_coordinates = [(x, y) for y in range(self.map_height) for x in range(self.map_width)
+                              if x != player.map_x or y != player.map_y]
+        shuffle(viable_coordinates)
+
+        # Each location takes the room from the next location in the list, and the last takes the first.
+        shuffled_rooms = [self.rooms[x][y] for x, y in viable_coordinates]
+        shuffled_rooms = shuffled_rooms[1:] + shuffled_rooms[:1]
+
+        for (x, y), room in zip(viable_coordinates, shuffled_rooms):
+            self.rooms[x][y] = room
+
+            if room is not EMPTY_ROOM:
+                self.rooms_index[room.room_id]["map_x"] = x  # Update the room index in place, keeping the room layout.
+                self.rooms_index[room.room_id]["map_y"] = y
+
+        for entity in entities:
+            if entity is player:
+                continue
+            else:
+                entity.set_map_position(self)
+
+        self.room_graph.rebuild()  # The rooms have new neighbours, so their exits match up differently.
+
+        return Message("You feel an odd sensation of movement...")
+
+    def explore_room(self, room):  # Mark everything in the room's FOV explored and update the map-wide totals.
+        if room is EMPTY_ROOM:  # Shared by every empty cell, so it never counts as explored.
+            return 0
+
+        newly_explored = room.explore_fov()
+
+        if newly_explored:
+            if room.explored_count == newly_explored:  # The first tiles seen in this room.
+                self.rooms_explored += 1
+
+            self.explored_cells += newly_explored
+
+        return newly_explored
+
+    def exploration_summary(self):
+        return {"explored_cells": self.explored_cells, "rooms_explored": self.rooms_explored,
+                "rooms": len(self.rooms_index)}
+
+    def fov_cache_stats(self):  # Total FOV cache hits and misses across every room in the map.
+        hits = 0
+        misses = 0
+
+        for room in self.materialised_rooms():
+            if isinstance(room, UnloadedRoom):
+                continue
+
+            hits += room.fov_cache_hits
+            misses += room.fov_cache_misses
+
+        return {"hits": hits, "misses": misses}
 
     def print_map(self):
         for y in range(self.map_height):
             print("")
             for x in range(self.map_width):
                 if not self.rooms[x][y].room_layout:
-                    print(" ", end="")
+                    print(" ", end=" ")
                 else:
                     if self.rooms[x][y].branch_level == 0:
                         print(".", end=' ')
@@ -183,6 +438,11 @@ class GameMap:
 
 
 class Room(Map):
+    """
+    A room is a tdl Map, so walkable, transparent and fov are numpy arrays indexed [x, y]. The explored layer
+    is a numpy array of the same shape, so every tile layer can be sliced, masked and handed straight to FOV
+    and pathfinding without conversion.
+    """
     def __init__(self, room_width, room_height, room_id, room_layout=False):
         super().__init__(room_width, room_height)
         self.room_id = room_id
@@ -190,13 +450,119 @@ class Room(Map):
         self.room_width = room_width
         self.room_height = room_height
 
-        self.explored = [[False for room_y in range(self.room_height)] for room_x in range(self.room_width)]
+        self.explored = numpy.zeros((self.room_width, self.room_height), dtype=bool)
+        self.explored_count = 0  # How many tiles of explored are set.
         self.colours = white
 
         self.room_layout = room_layout
         self.schematic = None
         self.branch_level = 0
 
+        # FOV results keyed by viewer position and FOV settings. Rooms are static between changes to their
+        # transparency, so the same key always gives the same visible set.
+        self.fov_cache = {}
+        self.fov_cache_hits = 0
+        self.fov_cache_misses = 0
+
+        # Distance in steps from every tile to flow_field_target, shared by every monster chasing that tile.
+        self.flow_field = None
+        self.flow_field_target = None
+
+        self.read_only = False  # Set by freeze(), for rooms that must never change.
+
+    def freeze(self):  # Make every tile layer read-only, so anything trying to change the room fails loudly.
+        for layer in (self.walkable, self.transparent, self.fov, self.explored):
+            layer.setflags(write=False)
+            if layer.base is not None:  # tdl's layers are views of one tile buffer, so freeze that too.
+                layer.base.setflags(write=False)
+
+        self.read_only = True
+
+    def compute_fov(self, x, y, fov='PERMISSIVE', radius=None, light_walls=True, sphere=True, cumulative=False):
+        if self.read_only:  # FOV is written straight into the tile buffer, past numpy's read-only flag.
+            raise ValueError("Can't compute FOV in read-only room {}".format(self.room_id))
+
+        key = (x, y, fov, radius, light_walls, sphere)
+        cached_fov = self.fov_cache.get(key)
+
+        if cached_fov is not None and not cumulative:
+            self.fov_cache_hits += 1
+            self.fov[...] = cached_fov
+        else:
+            self.fov_cache_misses += 1
+            super().compute_fov(x, y, fov=fov, radius=radius, light_walls=light_walls, sphere=sphere, cumulative=cumulative)
+
+            if not cumulative:
+                if len(self.fov_cache) >= FOV_CACHE_SIZE:
+                    self.fov_cache.clear()
+                self.fov_cache[key] = self.fov.copy()
+
+        return self.fov
+
+    def clear_fov_cache(self):  # Call whenever the room's transparency changes.
+        self.fov_cache.clear()
+
+    def compute_flow_field(self, target_x, target_y):
+        """
+        Breadth first search outwards from the target over walkable tiles, moving in all eight directions.
+        Each step grows the frontier by one tile in every direction as a whole-array operation. The result
+        is cached until the target moves or the room's tiles change.
+        """
+        if self.read_only:
+            raise ValueError("Can't cache a flow field in read-only room {}".format(self.room_id))
+
+        if self.flow_field_target == (target_x, target_y):
+            return self.flow_field
+
+        distances = compute_flow_distances(self.walkable, target_x, target_y)
+
+        self.flow_field = distances
+        self.flow_field_target = (target_x, target_y)
+
+        return distances
+
+    def clear_flow_field(self):  # Call whenever the room's walkable tiles change.
+        self.flow_field = None
+        self.flow_field_target = None
+
+    def tiles_changed(self):  # Throw away everything derived from the room's walkable and transparent layers.
+        self.clear_fov_cache()
+        self.clear_flow_field()
+
+    def explore_fov(self):  # Everything in the FOV has now been seen. Returns how many tiles that is for the first time.
+        newly_explored = self.fov & ~self.explored
+        newly_explored_count = int(numpy.count_nonzero(newly_explored))
+
+        if newly_explored_count:
+            self.explored |= newly_explored
+            self.explored_count += newly_explored_count
+
+        return newly_explored_count
+
+    def walkable_cells(self):  # An (n, 2) array of the x, y coordinates of every walkable tile.
+        return numpy.argwhere(self.walkable)
+
+
+class UnloadedRoom:
+    """
+    Stands in for a room whose tiles are still on disk, e.g. in a level pack. It knows everything about the room
+    except its tiles, so it can sit in the map, be shuffled and be drawn on the map like any other room until the
+    player enters it and GameMap.load_room swaps it for the Room that load() reads.
+    """
+    def __init__(self, room_id, room_layout, branch_level, colours, schematic, explored_count, load):
+        self.room_id = room_id
+        self.room_layout = room_layout
+        self.branch_level = branch_level
+        self.colours = colours
+        self.schematic = schematic
+        self.explored_count = explored_count
+        self.load = load
+
+
+# Every empty cell of every game map shares this room - solid rock, never carved, with no layout.
+EMPTY_ROOM = Room(ROOM_WIDTH, ROOM_HEIGHT, room_id=None)
+EMPTY_ROOM.freeze()
+
 
 def generate_map(game_map, entities, player):
     all_rooms = {}
@@ -207,14 +573,17 @@ def generate_map(game_map, entities, player):
             print(item.room_id, end=", ")
         print("")
 
-    main_path = create_path(game_map, path_length=10, source_x=10, source_y=10, all_rooms=all_rooms)
+    main_path = create_path(game_map, path_length=10, source_x=game_map.map_width // 2,
+                            source_y=game_map.map_height // 2, all_rooms=all_rooms)
     create_branched_rooms(game_map, iterations=5, all_rooms=all_rooms)
-    game_map.print_map()
+    create_loops(game_map, loop_fraction=LOOP_FRACTION)
+    lay_out_rooms(game_map)
+
+    game_map.room_graph.rebuild()
 
     player.current_room = main_path[0].room_id
     player.set_map_position(game_map)
 
-    # TODO : take all the rooms created, and figure out how to create loops between branches (nearby rooms).
     # TODO : apply room "decorators"
     # TODO : apply room types (combat, puzzle, etc)
 
@@ -249,7 +618,6 @@ def create_path(game_map, path_length, source_x, source_y, all_rooms):
     return rooms_in_path
 
 
-# TODO: fix bug where a room is created without a main area.
 # TODO: why is branch level 6 running twice?
 # TODO: figure out how the branching works...can we spread it out more?
 def create_branched_rooms(game_map, iterations, all_rooms):
@@ -289,6 +657,82 @@ def create_branched_rooms(game_map, iterations, all_rooms):
         branch_level += 1
 
 
+def find_loop_candidates(game_map):
+    """
+    Every pair of side by side rooms from different branches that could be joined into a loop, as
+    (room, exit type, neighbour) where the exit leads from room to neighbour. The carved rooms go into a neighbour
+    index of grid buckets keyed by map position, so each room only looks in the buckets east and south of it
+    (wrapping around the map edges like validate_coords) - linear in the number of rooms, whatever the map size.
+    Pairs already joined by matching exits are left out.
+    """
+    neighbour_index = {(entry["map_x"], entry["map_y"]): game_map.rooms[entry["map_x"]][entry["map_y"]]
+                       for entry in game_map.rooms_index.values()}
+    candidates = []
+
+    for (map_x, map_y), room in neighbour_index.items():
+        for exit_type in (RoomComponentTypes.east_exit, RoomComponentTypes.south_exit):  # So each pair is seen once.
+            dx, dy = EXIT_DIRECTIONS[exit_type]
+            neighbour = neighbour_index.get(validate_coords(map_x, map_y, dx, dy, game_map.map_width, game_map.map_height))
+
+            if neighbour is None or neighbour is room or neighbour.branch_level == room.branch_level:
+                continue
+
+            exit_flags = room.room_layout.get_exit_flags()
+            neighbour_exit_flags = neighbour.room_layout.get_exit_flags()
+
+            if exit_flags & EXIT_FLAGS[exit_type] and neighbour_exit_flags & EXIT_FLAGS[get_opposite_exit(exit_type)]:
+                continue
+
+            candidates.append((room, exit_type, neighbour))
+
+    return candidates
+
+
+def create_loops(game_map, loop_fraction):
+    # Join a random loop_fraction of the candidate pairs, so branches meet up again rather than all being dead ends.
+    candidates = find_loop_candidates(game_map)
+    shuffle(candidates)
+
+    for room, exit_type, neighbour in candidates[:math.ceil(len(candidates) * loop_fraction)]:
+        add_component_to_room(room, exit_type)
+        add_component_to_room(room, RoomComponentTypes.main_area)
+
+        add_component_to_room(neighbour, RoomComponentTypes.main_area)
+        add_component_to_room(neighbour, get_opposite_exit(exit_type))
+
+
+def compute_flow_distances(walkable, target_x, target_y):
+    # The steps from every walkable tile to the target, or UNREACHABLE. See Room.compute_flow_field.
+    width, height = walkable.shape
+
+    distances = numpy.full((width, height), UNREACHABLE, dtype=numpy.int32)
+    distances[target_x, target_y] = 0
+
+    frontier = numpy.zeros((width, height), dtype=bool)
+    frontier[target_x, target_y] = True
+
+    unvisited = numpy.array(walkable, dtype=bool)
+    unvisited[target_x, target_y] = False
+
+    steps = 0
+    while frontier.any():
+        steps += 1
+
+        # Grow the frontier one tile left and right, then grow that one tile up and down.
+        grown = frontier.copy()
+        grown[1:, :] |= frontier[:-1, :]
+        grown[:-1, :] |= frontier[1:, :]
+        spread = grown.copy()
+        spread[:, 1:] |= grown[:, :-1]
+        spread[:, :-1] |= grown[:, 1:]
+
+        frontier = spread & unvisited
+        distances[frontier] = steps
+        unvisited &= ~frontier
+
+    return distances
+
+
 def validate_coords(current_x, current_y, dx, dy, map_width, map_height):
     new_x = current_x + dx
     new_y = current_y + dy
@@ -310,11 +754,31 @@ def validate_coords(current_x, current_y, dx, dy, map_width, map_height):
     return new_x, new_y
 
 
+def step_across_rooms(game_map, map_x, map_y, room_x, room_y, dx, dy):
+    """
+    Where a step of dx, dy from a tile of the room at map_x, map_y lands, as (map_x, map_y, room_x, room_y).
+    Stepping off the edge of a room lands on the opposite edge of the room next door, wrapping around the map.
+    """
+    room = game_map.rooms[map_x][map_y]
+    room_x += dx
+    room_y += dy
+
+    map_dx = -1 if room_x < 0 else 1 if room_x >= room.room_width else 0
+    map_dy = -1 if room_y < 0 else 1 if room_y >= room.room_height else 0
+
+    if map_dx or map_dy:
+        map_x, map_y = validate_coords(map_x, map_y, map_dx, map_dy, game_map.map_width, game_map.map_height)
+        room_x %= room.room_width
+        room_y %= room.room_height
+
+    return map_x, map_y, room_x, room_y
+
+
 def create_linked_room(game_map, current_x, current_y, dx, dy, branch_level):
     linked_x, linked_y = validate_coords(current_x, current_y, dx, dy, game_map.map_width, game_map.map_height)
 
-    current_room = game_map.rooms[current_x][current_y]
-    linked_room = game_map.rooms[linked_x][linked_y]
+    current_room = game_map.materialise_room(current_x, current_y)
+    linked_room = game_map.materialise_room(linked_x, linked_y)
 
     if dx == 1:
         current_exit = RoomComponentTypes.east_exit
@@ -344,25 +808,52 @@ def create_linked_room(game_map, current_x, current_y, dx, dy, branch_level):
 
 
 def add_component_to_room(room, component_type):
+    # Only the layout changes here - lay_out_rooms carves every room's tiles in one go once generation is done.
     if component_type == RoomComponentTypes.north_exit:
         room.room_layout.north_exit = create_room_component(component_type)
-        room.room_layout.north_exit.create(room)
 
     elif component_type == RoomComponentTypes.east_exit:
         room.room_layout.east_exit = create_room_component(component_type)
-        room.room_layout.east_exit.create(room)
 
     elif component_type == RoomComponentTypes.south_exit:
         room.room_layout.south_exit = create_room_component(component_type)
-        room.room_layout.south_exit.create(room)
 
     elif component_type == RoomComponentTypes.west_exit:
         room.room_layout.west_exit = create_room_component(component_type)
-        room.room_layout.west_exit.create(room)
 
     elif component_type == RoomComponentTypes.main_area:
         room.room_layout.main_area = create_room_component(component_type)
-        room.room_layout.main_area.create(room)
+
+    room.schematic = SCHEMATICS_BY_EXITS.get(room.room_layout.get_exit_flags())
+
+
+def create_room_layout(schematic):  # A RoomLayout of the shared components making up this schematic.
+    room_layout = RoomLayout(create_room_component(RoomComponentTypes.main_area))
+    exit_flags = SCHEMATIC_EXITS[schematic]
+
+    if exit_flags & EXIT_FLAGS[RoomComponentTypes.north_exit]:
+        room_layout.north_exit = create_room_component(RoomComponentTypes.north_exit)
+    if exit_flags & EXIT_FLAGS[RoomComponentTypes.east_exit]:
+        room_layout.east_exit = create_room_component(RoomComponentTypes.east_exit)
+    if exit_flags & EXIT_FLAGS[RoomComponentTypes.south_exit]:
+        room_layout.south_exit = create_room_component(RoomComponentTypes.south_exit)
+    if exit_flags & EXIT_FLAGS[RoomComponentTypes.west_exit]:
+        room_layout.west_exit = create_room_component(RoomComponentTypes.west_exit)
+
+    return room_layout
+
+
+def lay_out_room(room):  # Lay the room's tiles with one copy of its schematic's precompiled mask.
+    mask = SCHEMATIC_MASKS[room.schematic]
+
+    room.walkable[...] = mask
+    room.transparent[...] = mask
+    room.tiles_changed()
+
+
+def lay_out_rooms(game_map):  # Carve every room generation made, once its layout is final.
+    for room in game_map.materialised_rooms():
+        lay_out_room(room)
 
 
 def get_unused_exits(room):
@@ -402,7 +893,7 @@ def get_adjacent_room(game_map, current_map_x, current_map_y, new_exit):
         dy = 0
 
     adjacent_x, adjacent_y = validate_coords(current_map_x, current_map_y, dx, dy, game_map.map_width, game_map.map_height)
-    adjacent_room = game_map.rooms[adjacent_x][adjacent_y]
+    adjacent_room = game_map.materialise_room(adjacent_x, adjacent_y)
 
     return adjacent_room
 
@@ -424,10 +915,12 @@ def get_opposite_exit(exit_component_type):
 
 
 def place_entities(game_map, room, entities, max_monsters_per_room, max_items_per_room):
+    walkable_cells = SCHEMATIC_CELLS[room.schematic]
+
     for i in range(randint(1, max_monsters_per_room)):
-        room_x, room_y = choice(room.coordinates)
+        room_x, room_y = choice(walkable_cells)
 
-        if not any([entity for entity in entities if entity.current_room == room.room_id and entity.room_x == room_x and entity.room_y == room_y]):
+        if not entities.at(room.room_id, room_x, room_y):
             monster_template = choice(monsters_list)
             monster = pick_monster(game_map, room.room_id, room_x, room_y, monster_template)
             entities.append(monster)  # This is that list from engine with just the player in it.
@@ -443,15 +936,16 @@ def place_entities(game_map, room, entities, max_monsters_per_room, max_items_pe
 
 
 def pick_monster(game_map, room_id, room_x, room_y, monster_template):
-    name, char, colour, hits, weapon = monster_template
+    name, char, colour, hits, weapon, speed = monster_template
 
-    weapon_name, weapon_char, weapon_colour, weapon_power, weapon_uses = weapon
+    weapon_name, weapon_char, weapon_colour, weapon_power, weapon_uses, weapon_speed = weapon
 
-    weapon_stats = Weapon(weapon_power, weapon_uses)
+    weapon_stats = Weapon(weapon_power, weapon_uses, weapon_speed)
     monster_weapon = Item(game_map, room_id, room_x, room_y, weapon_name, weapon_char, weapon_colour, weapon=weapon_stats)
 
     fighter_component = Fighter(hits, left_hand=monster_weapon)
     ai_component = BasicMonster()
-    monster = Actor(game_map, room_id, room_x, room_y, name, char, colour, fighter=fighter_component, ai=ai_component)
+    monster = Actor(game_map, room_id, room_x, room_y, name, char, colour, fighter=fighter_component, ai=ai_component,
+                    speed=speed)
 
     return monster
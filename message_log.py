@@ -1,31 +1,128 @@
-
-
+from collections import deque, Counter
 import textwrap
 
+HISTORY_SIZE = 1000  # Messages kept for scrolling back through; older ones drop off the end.
+
 
 class Message:
-    def __init__(self, text, colour=(255, 255, 255)):
+    def __init__(self, text, colour=(255, 255, 255), count=1):
         self.text = text
         self.colour = colour
+        self.count = count  # How many times in a row this message happened, shown as "x3" after the text.
+        self.wrapped_lines = {}  # width -> the text wrapped to that width, filled in the first time it's drawn.
+
+    def get_text(self):
+        if self.count > 1:
+            return "{0} x{1}".format(self.text, self.count)
+        return self.text
+
+    def repeat(self, count=1):
+        self.count += count
+        self.wrapped_lines = {}  # The text changed, so wrap it again next time.
+
+    def wrap(self, width):
+        if width not in self.wrapped_lines:
+            self.wrapped_lines[width] = textwrap.wrap(self.get_text(), width)
+
+        return self.wrapped_lines[width]
 
 
 class MessageLog:
-    def __init__(self, x, y, width, height):
-        self.messages = []
+    """
+    The message log keeps the last history_size messages as they were added, in a ring buffer, and only wraps a
+    message into lines when it's drawn. version goes up whenever what the log shows changes - a new message, or
+    scrolling - so the renderer can skip the panel entirely when nothing has happened.
+    scroll is how many lines back from the newest the panel is showing; page_up and page_down move it.
+    """
+    def __init__(self, x, y, width, height, history_size=HISTORY_SIZE):
+        self.messages = deque(maxlen=history_size)
         self.x = x
         self.y = y
         self.width = width
         self.height = height
+
+        self.scroll = 0
+        self.version = 0
+
         self.add_message(Message("Where am I? I have to get out of here..."))
 
     def add_message(self, message):
-        # split the messages across lines using text wrap
-        new_message_lines = textwrap.wrap(message.text, self.width)
+        self.add_messages([message])
+
+    def add_messages(self, messages):
+        # Add a whole batch as one change. A message repeating the newest one is counted on it rather than added.
+        if not messages:
+            return
+
+        for message in messages:
+            last_message = self.messages[-1] if self.messages else None
+
+            if last_message and last_message.text == message.text and last_message.colour == message.colour:
+                last_message.repeat(message.count)
+            else:
+                self.messages.append(message)
+
+        self.scroll = 0  # Jump back to the newest messages so the new ones are seen.
+        self.version += 1
+
+    def visible_lines(self):
+        # The height lines on show, oldest first, wrapping only as many messages as it takes to fill the panel.
+        lines = []
+        lines_to_skip = self.scroll
+
+        for message in reversed(self.messages):
+            for line in reversed(message.wrap(self.width)):
+                if lines_to_skip:
+                    lines_to_skip -= 1
+                    continue
+
+                lines.append(Message(line, message.colour))
+
+                if len(lines) == self.height:
+                    return lines[::-1]
+
+        return lines[::-1]
+
+    def page_up(self):
+        line_count = sum(len(message.wrap(self.width)) for message in self.messages)
+        self.scroll_to(min(self.scroll + self.height - 1, max(0, line_count - self.height)))
+
+    def page_down(self):
+        self.scroll_to(max(0, self.scroll - (self.height - 1)))
+
+    def scroll_to(self, scroll):
+        if scroll != self.scroll:
+            self.scroll = scroll
+            self.version += 1
+
+
+class MessageAggregator:
+    """
+    Collects a turn's messages before they reach the log, so crowded fights don't flood it: identical messages in
+    the same turn collapse into one with a count ("Lunatic attacks Player (1) x3"), and flush() hands the whole
+    turn to the log as a single update. counts keeps how many times each message text has come through.
+    """
+    def __init__(self):
+        self.pending = {}  # (text, colour) -> the collapsed Message, in the order each was first seen.
+        self.counts = Counter()
+
+        self.messages_received = 0
+        self.messages_logged = 0
+
+    def add(self, message):
+        key = (message.text, message.colour)
+
+        if key in self.pending:
+            self.pending[key].repeat()
+        else:
+            self.pending[key] = Message(message.text, message.colour)
+
+        self.counts[message.text] += 1
+        self.messages_received += 1
 
-        for line in new_message_lines:
-            # if the buffer is full, remove the first message to make room for the new one
-            if len(self.messages) == self.height:
-                del self.messages[0]
+    def flush(self, message_log):  # Send this turn's messages to the log, and start the next turn afresh.
+        messages = list(self.pending.values())
+        self.pending = {}
 
-            # add the new message line as Message object
-            self.messages.append(Message(line, message.colour))
+        message_log.add_messages(messages)
+        self.messages_logged += len(messages)
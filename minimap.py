@@ -0,0 +1,113 @@
+from map_system_2 import EMPTY_ROOM
+
+# A box drawing glyph (code page 437) for each combination of exits, as EXIT_FLAGS bits (north 1, east 2, south 4,
+# west 8), so a room's thumbnail shows the ways in and out of it.
+EXIT_GLYPHS = {0: 254,
+               1: 179, 4: 179, 5: 179,
+               2: 196, 8: 196, 10: 196,
+               3: 192, 9: 217, 6: 218, 12: 191,
+               7: 195, 13: 180, 14: 194, 11: 193,
+               15: 197}
+
+PLAYER_ROOM_BACKGROUND = (200, 200, 200)
+CURSOR_BACKGROUND = (0, 120, 200)
+BLANK = (" ", None, (0, 0, 0))
+
+
+class Minimap:
+    """
+    The minimap shows the whole game map, one cell per room, over the view port. Each room's thumbnail - its
+    exits as a box drawing glyph, bright once explored and dim before - is cached until the room is explored further
+    or its exits change. Each frame only the rooms are visited, never their tiles, and only cells that differ from
+    the last frame are drawn, so shuffled rooms and the player's room moving are the only things redrawn.
+    The cursor picks a room, e.g. to auto-travel to. Maps bigger than the console are shown in a window centred on
+    the cursor, which starts on the player's room.
+    """
+    def __init__(self, console, width, height):
+        self.console = console
+        self.width = width
+        self.height = height
+
+        self.visible = False
+        self.cursor = None  # The map position of the room picked on the minimap, when it's showing.
+
+        self.thumbnails = {}  # room_id -> (explored_count, exit_flags, (glyph, colour))
+        self.drawn_cells = {}  # (x, y) on the console -> (glyph, colour, background) drawn there.
+
+    def toggle(self, player):
+        self.visible = not self.visible
+        self.cursor = (player.map_x, player.map_y)
+
+    def move_cursor(self, dx, dy, game_map):  # Wraps around the map edges, like the rooms do.
+        self.cursor = ((self.cursor[0] + dx) % game_map.map_width, (self.cursor[1] + dy) % game_map.map_height)
+
+    def get_selected_room(self, game_map):  # The room_id under the cursor, or None over an empty cell.
+        return game_map.rooms[self.cursor[0]][self.cursor[1]].room_id
+
+    def get_thumbnail(self, room):
+        explored_count = room.explored_count
+        exit_flags = room.room_layout.get_exit_flags()
+
+        cached = self.thumbnails.get(room.room_id)
+        if cached and cached[0] == explored_count and cached[1] == exit_flags:
+            return cached[2]
+
+        colour = room.colours.light_wall if explored_count else room.colours.dark_ground
+        thumbnail = (EXIT_GLYPHS[exit_flags], colour)
+        self.thumbnails[room.room_id] = (explored_count, exit_flags, thumbnail)
+
+        return thumbnail
+
+    def get_origin(self, game_map, map_x, map_y):  # The map position shown in the console's top left corner.
+        origin_x = min(max(map_x - self.width // 2, 0), max(game_map.map_width - self.width, 0))
+        origin_y = min(max(map_y - self.height // 2, 0), max(game_map.map_height - self.height, 0))
+
+        # Centre maps that are smaller than the console.
+        offset_x = max(self.width - game_map.map_width, 0) // 2
+        offset_y = max(self.height - game_map.map_height, 0) // 2
+
+        return origin_x - offset_x, origin_y - offset_y
+
+    def render(self, game_map, player):  # Draw what changed since last frame. Returns whether anything was drawn.
+        cursor = self.cursor or (player.map_x, player.map_y)
+        origin_x, origin_y = self.get_origin(game_map, *cursor)
+        cells = {}
+
+        for entry in game_map.rooms_index.values():
+            x = entry["map_x"] - origin_x
+            y = entry["map_y"] - origin_y
+
+            if not (0 <= x < self.width and 0 <= y < self.height):
+                continue
+
+            room = game_map.rooms[entry["map_x"]][entry["map_y"]]
+            if room is EMPTY_ROOM:
+                continue
+
+            glyph, colour = self.get_thumbnail(room)
+
+            if (entry["map_x"], entry["map_y"]) == (player.map_x, player.map_y):
+                cells[(x, y)] = (glyph, (0, 0, 0), PLAYER_ROOM_BACKGROUND)
+            else:
+                cells[(x, y)] = (glyph, colour, (0, 0, 0))
+
+        cursor_cell = (cursor[0] - origin_x, cursor[1] - origin_y)
+        glyph = cells.get(cursor_cell, BLANK)
+        cells[cursor_cell] = (glyph[0], glyph[1], CURSOR_BACKGROUND)
+
+        changed = False
+
+        for cell in set(cells) | set(self.drawn_cells):
+            glyph = cells.get(cell, BLANK)
+
+            if self.drawn_cells.get(cell, BLANK) != glyph:
+                self.console.draw_char(cell[0], cell[1], glyph[0], fg=glyph[1], bg=glyph[2])
+                changed = True
+
+        self.drawn_cells = cells
+
+        return changed
+
+    def invalidate(self):  # Forget what's on the console, so the next render draws every room again.
+        self.console.clear()
+        self.drawn_cells = {}
@@ -0,0 +1,135 @@
+from map_system_2 import RoomComponentTypes, EXIT_DIRECTIONS, ROOM_WIDTH, ROOM_HEIGHT, compute_flow_distances, \
+    step_across_rooms
+from entities import NEIGHBOURS, get_blocking_entities_at_location
+
+# The tile in the middle of each exit, on the edge of the room, where actors step through into the next room.
+# Exits line up across rooms, so stepping through one doorway lands on the opposite doorway next door.
+DOORWAYS = {RoomComponentTypes.north_exit: (ROOM_WIDTH // 2, 0),
+            RoomComponentTypes.east_exit: (ROOM_WIDTH - 1, ROOM_HEIGHT // 2),
+            RoomComponentTypes.south_exit: (ROOM_WIDTH // 2, ROOM_HEIGHT - 1),
+            RoomComponentTypes.west_exit: (0, ROOM_HEIGHT // 2)}
+
+MAIN_AREA_CENTRE = (ROOM_WIDTH // 2, ROOM_HEIGHT // 2)  # Inside the main area, and outside every exit.
+
+
+def get_layout_signature(room):
+    # Rooms are built only from the shared room components, so two rooms with the same exits have the same tiles -
+    # unless one never had its main area carved, as in rooms saved by older builds, so that's checked too.
+    return room.room_layout.get_exit_flags(), bool(room.walkable[MAIN_AREA_CENTRE])
+
+
+class PathFinder:
+    """
+    Finds the way between rooms in two levels. The coarse level is the room graph: a route is the exit to leave
+    each room by, found breadth first over the rooms and kept until the graph is rebuilt. The fine level is inside
+    a room: the distance from every tile to each exit's doorway, cached per layout signature rather than per room.
+    Every room with the same layout has the same tiles, so a handful of these fields cover every exit-to-exit path
+    (and every way from anywhere else in a room to an exit) on the whole map.
+    Each step is then a route lookup and a look at eight neighbouring tiles, so it costs the same however many tiles
+    the map has.
+    """
+    def __init__(self, game_map):
+        self.game_map = game_map
+
+        self.routes = {}  # (start room_id, goal room_id) -> [(room_id, exit type to leave it by), ...] or None.
+        self.routes_version = None  # The room graph version the routes were found on.
+
+        self.exit_fields = {}  # (layout signature, exit type) -> steps to that exit's doorway from every tile.
+        self.exit_field_hits = 0
+        self.exit_field_misses = 0
+
+    def find_route(self, start_room, goal_room):
+        # The exit to leave each room by, from start_room to goal_room: empty if they're the same, None if there's no way.
+        room_graph = self.game_map.room_graph
+
+        if room_graph.version != self.routes_version:  # Rooms have moved, so every route is out of date.
+            self.routes = {}
+            self.routes_version = room_graph.version
+
+        key = (start_room, goal_room)
+
+        if key not in self.routes:
+            rooms = room_graph.find_route(start_room, goal_room)
+
+            if rooms is None:
+                self.routes[key] = None
+            else:
+                route = []
+
+                for room_id, next_room_id in zip(rooms, rooms[1:]):
+                    exit_type = next(exit_type for exit_type, neighbour_id in room_graph.exits[room_id].items()
+                                     if neighbour_id == next_room_id)
+                    route.append((room_id, exit_type))
+
+                self.routes[key] = route
+
+        return self.routes[key]
+
+    def get_exit_field(self, room, exit_type):
+        key = (get_layout_signature(room), exit_type)
+        exit_field = self.exit_fields.get(key)
+
+        if exit_field is None:
+            self.exit_field_misses += 1
+
+            exit_field = compute_flow_distances(room.walkable, *DOORWAYS[exit_type])
+            exit_field.setflags(write=False)  # Shared by every room with this layout.
+            self.exit_fields[key] = exit_field
+
+        else:
+            self.exit_field_hits += 1
+
+        return exit_field
+
+    def next_step(self, actor, goal_room, entities):
+        """
+        The (dx, dy) that takes actor one step along the shortest way to the room goal_room, or None if it's there
+        already, there's no way there, or the way is blocked this turn. Steps off the edge of a room lead into the
+        next room, as step_across_rooms works out.
+        """
+        if actor.current_room == goal_room:
+            return None
+
+        route = self.find_route(actor.current_room, goal_room)
+
+        if not route:
+            return None
+
+        exit_type = route[0][1]
+        room = self.game_map.rooms[actor.map_x][actor.map_y]
+        exit_field = self.get_exit_field(room, exit_type)
+        distance = exit_field[actor.room_x, actor.room_y]
+
+        if distance == 0:  # On the doorway, so step through it if nothing is standing on the other side.
+            dx, dy = EXIT_DIRECTIONS[exit_type]
+            map_x, map_y, room_x, room_y = step_across_rooms(self.game_map, actor.map_x, actor.map_y,
+                                                             actor.room_x, actor.room_y, dx, dy)
+            next_room = self.game_map.load_room(map_x, map_y)
+
+            if get_blocking_entities_at_location(entities, next_room.room_id, room_x, room_y):
+                return None
+
+            return dx, dy
+
+        # Otherwise walk downhill towards the doorway, around anything in the way.
+        best_step = None
+        best_distance = distance
+
+        for dx, dy in NEIGHBOURS:
+            x = actor.room_x + dx
+            y = actor.room_y + dy
+
+            if not (0 <= x < room.room_width and 0 <= y < room.room_height) or exit_field[x, y] >= best_distance:
+                continue
+
+            if get_blocking_entities_at_location(entities, actor.current_room, x, y):
+                continue
+
+            best_step = (dx, dy)
+            best_distance = exit_field[x, y]
+
+        return best_step
+
+    def stats(self):
+        return {"routes": len(self.routes), "exit_fields": len(self.exit_fields),
+                "exit_field_hits": self.exit_field_hits, "exit_field_misses": self.exit_field_misses}
@@ -1,4 +1,5 @@
 from enum import Enum
+import numpy
 
 
 class RenderOrder(Enum):
@@ -42,59 +43,158 @@ def render_status_bar(panel, x, y, width, current_value, maximum_value, bar_colo
         panel.draw_rect(x, y, bar_width, 1, None, bg=bar_colour)
 
 
-def render_all(consoles, game_map, entities, player, fov_recompute, message_log):
+class RenderState:
+    """
+    The render state remembers what render_all drew last frame - the room and FOV in the view port, the entity
+    glyphs, the status panel and the message lines - so that only the parts that changed are drawn again.
+    Set full_redraw to redraw everything every frame, which is handy when debugging the renderer.
+    """
+    def __init__(self, full_redraw=False):
+        self.full_redraw = full_redraw
+        self.room_id = None
+        self.fov = None
+        self.entity_glyphs = {}
+        self.status = None
+        self.message_lines = []
+        self.message_version = None
+
+    def invalidate(self):  # Forget the last frame so the next render_all redraws everything once.
+        self.room_id = None
+        self.fov = None
+        self.entity_glyphs = {}
+        self.status = None
+        self.message_lines = []
+        self.message_version = None
+
+
+def render_all(consoles, game_map, entities, player, fov_recompute, message_log, render_state, minimap=None):
 
     # Unpack consoles
     root_console, view_port_console, bottom_panel_console, top_panel_console = consoles
 
+    room = game_map.rooms[player.map_x][player.map_y]
+    full_redraw = render_state.full_redraw or render_state.room_id != room.room_id
+
+    # Work out which tiles need drawing: all of them in a new room, otherwise only those whose FOV changed.
+    if full_redraw:
+        dirty_cells = set(room)
+    elif fov_recompute:
+        changed_x, changed_y = numpy.nonzero(room.fov != render_state.fov)
+        dirty_cells = set(zip(changed_x.tolist(), changed_y.tolist()))
+    else:
+        dirty_cells = set()
+
+    # Entities visible in this room, by tile. Later entries in render order are drawn on top, so they win.
+    entity_glyphs = {}
+    for entity in sorted(entities.in_room(room.room_id), key=lambda x: x.render_order.value):
+        if room.fov[entity.room_x, entity.room_y]:
+            entity_glyphs[(entity.room_x, entity.room_y)] = (entity.char, entity.colour)
+
+    # Tiles where an entity appeared, moved away or changed glyph need drawing too.
+    for cell in set(entity_glyphs) | set(render_state.entity_glyphs):
+        if entity_glyphs.get(cell) != render_state.entity_glyphs.get(cell):
+            dirty_cells.add(cell)
+
+    for x, y in dirty_cells:
+        draw_tile(view_port_console, room, x, y)
+
+        glyph = entity_glyphs.get((x, y))
+        if glyph:
+            view_port_console.draw_char(x, y, glyph[0], glyph[1], bg=None)
+
+    render_state.room_id = room.room_id
+    render_state.fov = room.fov.copy()
+    render_state.entity_glyphs = entity_glyphs
+
+    # Now blit the view port console onto the root console - or the minimap over it, if that's showing.
+    if minimap and minimap.visible:
+        if minimap.render(game_map, player) or full_redraw:
+            root_console.blit(minimap.console, 11, 11, 30, 30, 0, 0)
+
+    elif dirty_cells:
+        root_console.blit(view_port_console, 11, 11, 30, 30, 0, 0)
+
+    # Draw stuff on top panel, but only if something it shows has changed.
+    status = get_status(player)
+
+    if full_redraw or status != render_state.status:
+        render_top_panel(top_panel_console, player)
+        root_console.blit(top_panel_console, 1, 1, 42, 10, 0, 0)
+        render_state.status = status
+
+    # Print the game messages, redrawing only the lines that differ from last frame - if the log changed at all.
+    if full_redraw or message_log.version != render_state.message_version:
+        message_lines = [(message.text, message.colour) for message in message_log.visible_lines()]
+        render_state.message_version = message_log.version
+    else:
+        message_lines = render_state.message_lines
+
+    changed_lines = 0
+
+    for i in range(max(len(message_lines), len(render_state.message_lines))):
+        line = message_lines[i] if i < len(message_lines) else None
+        last_line = render_state.message_lines[i] if i < len(render_state.message_lines) else None
+
+        if full_redraw or line != last_line:
+            y = message_log.y + i
+            bottom_panel_console.draw_rect(0, y, None, 1, " ", bg=(0, 0, 0))
+            if line:
+                bottom_panel_console.draw_str(message_log.x, y, line[0], bg=None, fg=line[1])
+            changed_lines += 1
+
+    render_state.message_lines = message_lines
+
+    # Blit the bottom panel onto the root console.
+    if changed_lines:
+        root_console.blit(bottom_panel_console, 1, 42, 50, 10, 0, 0)
+
+
+def draw_tile(view_port_console, room, x, y):
     # Single cross = 197, double cross = 206
     # texblock = 177
 
     ground_char = 197
     wall_char = None
 
-    # Draw all the tiles in the game map
-    if fov_recompute:
-        # Make sure the player is always centered in the view port - but stop when we get to the edge of the map.
-        for x, y in game_map.rooms[player.map_x][player.map_y]:
-
-            # Load room colours
-            light_wall, dark_wall, light_ground, dark_ground = game_map.rooms[player.map_x][player.map_y].colours
+    # Load room colours
+    light_wall, dark_wall, light_ground, dark_ground = room.colours
 
-            wall = not game_map.rooms[player.map_x][player.map_y].transparent[x][y]
+    wall = not room.transparent[x, y]
 
-            # In FOV
-            if game_map.rooms[player.map_x][player.map_y].fov[x, y]:
-                if wall:
-                    view_port_console.draw_char(x, y, wall_char, bg=light_wall, fg=None)
-                else:
-                    view_port_console.draw_char(x, y, ground_char, bg=None, fg=light_ground)
+    # In FOV
+    if room.fov[x, y]:
+        if wall:
+            view_port_console.draw_char(x, y, wall_char, bg=light_wall, fg=None)
+        else:
+            view_port_console.draw_char(x, y, ground_char, bg=None, fg=light_ground)
 
-                game_map.rooms[player.map_x][player.map_y].explored[x][y] = True
+    # Outside FOV, explored already
+    elif room.explored[x, y]:
+        if wall:
+            view_port_console.draw_char(x, y, wall_char, bg=dark_wall, fg=None)
+        else:
+            view_port_console.draw_char(x, y, ground_char, bg=None, fg=dark_ground)
 
-            # Outside FOV, explored already
-            elif game_map.rooms[player.map_x][player.map_y].explored[x][y]:
-                if wall:
-                    view_port_console.draw_char(x, y, wall_char, bg=dark_wall, fg=None)
-                else:
-                    view_port_console.draw_char(x, y, ground_char, bg=None, fg=dark_ground)
+    # Never seen
+    else:
+        view_port_console.draw_char(x, y, " ", fg=None, bg=(0, 0, 0))
 
-    # Draw all entities in the list
-    entities_in_this_room = []
-    for entity in entities:
-        if entity.map_x == player.map_x and entity.map_y == player.map_y:
-            entities_in_this_room.append(entity)
 
-    entities_in_render_order = sorted(entities_in_this_room, key=lambda x: x.render_order.value)
+def get_status(player):
+    # Everything shown on the top panel, so we can tell when it needs redrawing.
+    hands = []
+    for hand in (player.fighter.left_hand, player.fighter.right_hand):
+        if hand and hand.weapon:
+            hands.append((hand.name, hand.weapon.uses, hand.weapon.max_uses))
+        elif hand:
+            hands.append((hand.name, None, None))
+        else:
+            hands.append(None)
 
-    for entity in entities_in_render_order:
-        draw_entity(view_port_console, entity, game_map.rooms[player.map_x][player.map_y].fov)
+    return player.name, player.fighter.hits, player.fighter.max_hits, player.fighter.selected_hand, tuple(hands)
 
-    # Now blit the view port console onto the root console.
-    root_console.blit(view_port_console, 11, 11, 30, 30, 0, 0)
-    view_port_console.clear()
 
-    # Draw stuff on top panel
+def render_top_panel(top_panel_console, player):
     top_panel_console.clear(fg=(255, 255, 255), bg=(0, 0, 0))
 
     top_panel_console.draw_str(0, 0, player.name, fg=(255, 255, 255), bg=None)
@@ -132,33 +232,3 @@ def render_all(consoles, game_map, entities, player, fov_recompute, message_log)
         top_panel_console.draw_str(19, 4, lh_name, fg=(0, 0, 0), bg=(0, 200, 0))
         top_panel_console.draw_str(0, 5, "Right Hand: ", fg=(255, 255, 255), bg=None)
         top_panel_console.draw_str(19, 5, rh_name, fg=(255, 255, 255), bg=(0, 0, 0))
-
-    # blit top panel to root
-    root_console.blit(top_panel_console, 1, 1, 42, 10, 0, 0)
-
-    # Draw stuff on bottom panel
-    bottom_panel_console.clear(fg=(255, 255, 255), bg=(0, 0, 0))
-
-    # Print the game messages, one line at a time
-    y = message_log.y
-    for message in message_log.messages:
-        bottom_panel_console.draw_str(message_log.x, y, message.text, bg=None, fg=message.colour)
-        y += 1
-
-    # Blit the bottom panel onto the root console.
-    root_console.blit(bottom_panel_console, 1, 42, 50, 10, 0, 0)
-
-
-def clear_all(view_port_console, entities):  # This is dirty...
-    for entity in entities:
-        clear_entity(view_port_console, entity)
-
-
-def draw_entity(view_port_console, entity, fov):
-    if fov[entity.room_x, entity.room_y]:
-        view_port_console.draw_char(entity.room_x, entity.room_y, entity.char, entity.colour, bg=None)
-
-
-def clear_entity(view_port_console, entity):
-    # erase the character that represents this object
-    view_port_console.draw_char(entity.room_x, entity.room_y, ' ', entity.colour, bg=None)
@@ -0,0 +1,17 @@
+import random
+
+# The one random number stream for the whole game. Map generation, entity placement, combat and AI all draw from
+# it, so seeding it once at the start of a run makes the whole run reproducible.
+PRNG = random.Random()
+
+choice = PRNG.choice
+shuffle = PRNG.shuffle
+randint = PRNG.randint
+
+
+def seed(value):
+    PRNG.seed(value)
+
+
+def new_seed():  # A fresh seed for a run nobody asked to seed, so it can still be recorded and replayed.
+    return random.SystemRandom().randrange(2 ** 32)
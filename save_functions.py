@@ -0,0 +1,282 @@
+from map_system_2 import GameMap, Room, UnloadedRoom, RoomLayout, RoomComponentTypes, Schematic, SCHEMATICS_BY_EXITS, \
+    room_colours, create_room_component, create_room_layout
+from entities import Actor, Item, EntityRegistry
+from components import Fighter, BasicMonster, Weapon
+from render import RenderOrder
+from functools import partial
+import numpy
+import struct
+
+# Binary save format, all little endian:
+#
+#     header          HEADER
+#     string table    uint32 byte length, then every string utf-8 encoded and separated by NUL bytes
+#     room table      ROOM_RECORD per room
+#     tile layers     walkable, transparent and explored for each room in turn, each packed 8 tiles to a byte
+#     entity table    ENTITY_RECORD per entity, held items included
+#
+# Room ids, entity names and entity chars are stored as indexes into the string table. Entity records refer to
+# rooms by their position in the room table, and fighters refer to the items in their hands by record index.
+
+MAGIC = b"7DRL"
+VERSION = 3
+
+HEADER = struct.Struct("<4sBHHBBIIi")  # magic, version, map w/h, room w/h, room count, entity count, player record
+ROOM_RECORD = struct.Struct("<IHHBBBBH")  # room id, map x/y, exit flags, branch level, colours, schematic, explored count
+ENTITY_RECORD = struct.Struct("<BBHBBII3BBBBhhBhhBHBhhhH")
+
+NO_ROOM = 0xFFFF
+NO_SCHEMATIC = 0xFF
+NO_ITEM = -1
+
+ACTOR = 1
+ITEM = 2
+
+TILE_LAYERS = 3  # walkable, transparent, explored
+
+hand_codes = {None: 0, "left": 1, "right": 2}
+hand_names = {0: None, 1: "left", 2: "right"}
+
+
+class StringTable:  # Collects strings while saving, handing back each one's index.
+    def __init__(self):
+        self.strings = []
+        self.indexes = {}
+
+    def add(self, string):
+        if string not in self.indexes:
+            self.indexes[string] = len(self.strings)
+            self.strings.append(string)
+        return self.indexes[string]
+
+    def pack(self):
+        blob = "\0".join(self.strings).encode("utf-8")
+        return struct.pack("<I", len(blob)) + blob
+
+
+def pack_game(game_map, entities, player):
+    strings = StringTable()
+
+    # Rooms that were never entered still have to be read, to copy their tiles into the save.
+    rooms = [game_map.load_room(entry["map_x"], entry["map_y"]) for entry in list(game_map.rooms_index.values())]
+    room_numbers = {room.room_id: number for number, room in enumerate(rooms)}
+
+    room_records = []
+    for room in rooms:
+        entry = game_map.rooms_index[room.room_id]
+        schematic = room.schematic.value if room.schematic else NO_SCHEMATIC
+        room_records.append(ROOM_RECORD.pack(strings.add(room.room_id), entry["map_x"], entry["map_y"],
+                                             room.room_layout.get_exit_flags(), room.branch_level,
+                                             room_colours.index(room.colours), schematic, room.explored_count))
+
+    # Every tile layer of every room in one array, packed to bits in a single call.
+    room_cells = rooms[0].room_width * rooms[0].room_height if rooms else 0
+    tile_layers = numpy.zeros((len(rooms), TILE_LAYERS, room_cells), dtype=bool)
+    for number, room in enumerate(rooms):
+        tile_layers[number, 0] = numpy.ravel(room.walkable)
+        tile_layers[number, 1] = numpy.ravel(room.transparent)
+        tile_layers[number, 2] = numpy.ravel(room.explored)
+
+    entity_records, player_record = pack_entities(entities, player, room_numbers, strings)
+
+    header = HEADER.pack(MAGIC, VERSION, game_map.map_width, game_map.map_height,
+                         rooms[0].room_width if rooms else 0, rooms[0].room_height if rooms else 0,
+                         len(rooms), len(entity_records), player_record)
+
+    return b"".join([header, strings.pack()] + room_records + [numpy.packbits(tile_layers, axis=-1).tobytes()] +
+                    entity_records)
+
+
+def pack_entities(entities, player, room_numbers, strings):
+    # Held items aren't in the registry, so give them records too, straight after the registry's entities.
+    all_entities = list(entities)
+    registered_count = len(all_entities)
+
+    for entity in entities:
+        if entity.fighter:
+            for hand in (entity.fighter.left_hand, entity.fighter.right_hand):
+                if hand:
+                    all_entities.append(hand)
+
+    record_numbers = {id(entity): number for number, entity in enumerate(all_entities)}
+
+    records = []
+    player_record = NO_ITEM
+
+    for number, entity in enumerate(all_entities):
+        kind = ITEM if isinstance(entity, Item) else ACTOR
+        room = room_numbers[entity.current_room] if entity.current_room is not None else NO_ROOM
+        red, green, blue = entity.colour
+
+        fighter = entity.fighter
+        if fighter:
+            fighter_fields = (1, fighter.hits, fighter.max_hits, hand_codes[fighter.selected_hand],
+                              record_numbers[id(fighter.left_hand)] if fighter.left_hand else NO_ITEM,
+                              record_numbers[id(fighter.right_hand)] if fighter.right_hand else NO_ITEM)
+        else:
+            fighter_fields = (0, 0, 0, 0, NO_ITEM, NO_ITEM)
+
+        weapon = entity.weapon if kind == ITEM else False
+        if weapon:
+            weapon_fields = (1, weapon.power, weapon.uses, weapon.max_uses, weapon.speed)
+        else:
+            weapon_fields = (0, 0, 0, 0, 0)
+
+        speed = entity.speed if kind == ACTOR else 0
+
+        records.append(ENTITY_RECORD.pack(kind, number < registered_count, room, entity.room_x, entity.room_y,
+                                          strings.add(entity.name), strings.add(entity.char), red, green, blue,
+                                          entity.blocks, entity.render_order.value, *fighter_fields,
+                                          1 if entity.ai else 0, speed, *weapon_fields))
+
+        if entity is player:
+            player_record = number
+
+    return records, player_record
+
+
+def unpack_game(data, lazy=False):
+    """
+    Rebuilds the game map, entity registry and player from pack_game's bytes. Returns (game_map, entities, player).
+    With lazy=True, no tiles are read: every room starts as an UnloadedRoom that reads its own tiles from data when
+    GameMap.load_room is called, so data has to stay readable (e.g. an open mmap) for as long as the map is in use.
+    """
+    magic, version, map_width, map_height, room_width, room_height, room_count, entity_count, player_record = \
+        HEADER.unpack_from(data, 0)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version {} 7DRL save file.".format(VERSION))
+
+    offset = HEADER.size
+    (strings_length,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    strings = bytes(data[offset:offset + strings_length]).decode("utf-8").split("\0")
+    offset += strings_length
+
+    game_map = GameMap(map_width, map_height)
+
+    room_records = list(ROOM_RECORD.iter_unpack(data[offset:offset + ROOM_RECORD.size * room_count]))
+    offset += ROOM_RECORD.size * room_count
+
+    room_tiles_bytes = TILE_LAYERS * ((room_width * room_height + 7) // 8)
+    tiles_offset = offset
+    offset += room_count * room_tiles_bytes
+
+    if not lazy:
+        tile_layers = unpack_tile_layers(data, tiles_offset, room_count, room_width, room_height)
+
+    rooms = []
+    for number, (room_id, map_x, map_y, exit_flags, branch_level, colours, schematic, explored_count) in enumerate(room_records):
+        room_id = strings[room_id]
+        room_layout = create_layout(exit_flags)
+        colours = room_colours[colours]
+        schematic = Schematic(schematic) if schematic != NO_SCHEMATIC else None
+
+        if lazy:
+            load = partial(load_room_tiles, data, tiles_offset + number * room_tiles_bytes, room_width, room_height,
+                           room_id, room_layout, branch_level, colours, schematic)
+            room = UnloadedRoom(room_id, room_layout, branch_level, colours, schematic, explored_count, load)
+        else:
+            room = create_room(tile_layers[number], room_id, room_layout, branch_level, colours, schematic)
+
+        game_map.add_room(room, map_x, map_y)
+        rooms.append(room)
+
+    game_map.room_graph.rebuild()
+
+    entity_records = list(ENTITY_RECORD.iter_unpack(data[offset:offset + ENTITY_RECORD.size * entity_count]))
+    entities, player = unpack_entities(entity_records, player_record, rooms, strings, game_map)
+
+    return game_map, entities, player
+
+
+def unpack_tile_layers(data, offset, room_count, room_width, room_height):
+    # The tile layers of room_count rooms starting at offset, as a bool array of [room, layer, x, y].
+    room_cells = room_width * room_height
+    layer_bytes = (room_cells + 7) // 8
+
+    packed_layers = numpy.frombuffer(data, dtype=numpy.uint8, count=room_count * TILE_LAYERS * layer_bytes, offset=offset)
+    tile_layers = numpy.unpackbits(packed_layers.reshape(room_count, TILE_LAYERS, layer_bytes), axis=-1, count=room_cells)
+
+    return tile_layers.reshape(room_count, TILE_LAYERS, room_width, room_height).astype(bool)
+
+
+def load_room_tiles(data, offset, room_width, room_height, room_id, room_layout, branch_level, colours, schematic):
+    tile_layers = unpack_tile_layers(data, offset, 1, room_width, room_height)
+    return create_room(tile_layers[0], room_id, room_layout, branch_level, colours, schematic)
+
+
+def create_room(tile_layers, room_id, room_layout, branch_level, colours, schematic):
+    room = Room(tile_layers.shape[1], tile_layers.shape[2], room_id=room_id, room_layout=room_layout)
+    room.walkable[...] = tile_layers[0]
+    room.transparent[...] = tile_layers[1]
+    room.explored[...] = tile_layers[2]
+    room.explored_count = int(numpy.count_nonzero(room.explored))
+    room.branch_level = branch_level
+    room.colours = colours
+    room.schematic = schematic
+
+    return room
+
+
+def create_layout(exit_flags):
+    if exit_flags in SCHEMATICS_BY_EXITS:
+        return create_room_layout(SCHEMATICS_BY_EXITS[exit_flags])
+
+    return RoomLayout(create_room_component(RoomComponentTypes.main_area))  # No exits yet.
+
+
+def unpack_entities(entity_records, player_record, rooms, strings, game_map):
+    rebuilt = [None] * len(entity_records)
+
+    # Items first, so fighters can pick up the items in their hands.
+    for kinds in ((ITEM,), (ACTOR,)):
+        for number, record in enumerate(entity_records):
+            (kind, registered, room, room_x, room_y, name, char, red, green, blue, blocks, render_order,
+             has_fighter, hits, max_hits, selected_hand, left_hand, right_hand, has_ai, speed,
+             has_weapon, power, uses, max_uses, weapon_speed) = record
+
+            if kind not in kinds:
+                continue
+
+            room_id = rooms[room].room_id if room != NO_ROOM else None
+            colour = (red, green, blue)
+
+            if kind == ITEM:
+                weapon = False
+                if has_weapon:
+                    weapon = Weapon(power, max_uses, weapon_speed)
+                    weapon.uses = uses
+
+                entity = Item(game_map, room_id, room_x, room_y, strings[name], strings[char], colour,
+                              blocks=bool(blocks), render_order=RenderOrder(render_order), weapon=weapon)
+            else:
+                fighter = False
+                if has_fighter:
+                    fighter = Fighter(max_hits, left_hand=rebuilt[left_hand] if left_hand != NO_ITEM else None,
+                                      right_hand=rebuilt[right_hand] if right_hand != NO_ITEM else None,
+                                      selected_hand=hand_names[selected_hand])
+                    fighter.hits = hits
+
+                entity = Actor(game_map, room_id, room_x, room_y, strings[name], strings[char], colour,
+                               blocks=bool(blocks), render_order=RenderOrder(render_order), fighter=fighter,
+                               ai=BasicMonster() if has_ai else False, speed=speed)
+
+            rebuilt[number] = entity
+
+    entities = EntityRegistry()
+    for entity, record in zip(rebuilt, entity_records):
+        if record[1]:  # Registered, rather than held in a hand.
+            entities.append(entity)
+
+    return entities, rebuilt[player_record]
+
+
+def save_game(path, game_map, entities, player):
+    with open(path, "wb") as save_file:
+        save_file.write(pack_game(game_map, entities, player))
+
+
+def load_game(path):
+    with open(path, "rb") as save_file:
+        return unpack_game(save_file.read())
@@ -1,7 +1,7 @@
 from collections import namedtuple
 
 # Weapons
-weapon = namedtuple("weapon", ["name", "char", "colour", "power", "uses"])
+weapon = namedtuple("weapon", ["name", "char", "colour", "power", "uses", "speed"], defaults=[100])
 
 # TODO: need to make two weapon variants - one that doesn't break (for the monster to attack with) and one to loot drop
 dagger = weapon("Dagger", "d", (255, 255, 255), 1, 1)
@@ -10,7 +10,7 @@ weapons_list = [dagger]
 
 
 # Monsters
-monster = namedtuple("monster", ["name", "char", "colour", "hits", "weapon"])
+monster = namedtuple("monster", ["name", "char", "colour", "hits", "weapon", "speed"], defaults=[100])
 
 lunatic = monster("Lunatic", "l", (255, 255, 255), 1, dagger)
 
@@ -0,0 +1,79 @@
+from ai_functions import take_monster_turns
+from heapq import heappush, heappop
+from itertools import count
+
+ACTION_TIME = 100  # How long one action takes at normal speed.
+NORMAL_SPEED = 100
+
+
+def get_action_time(actor, attacking=False):
+    # Faster actors act more often; attacking takes longer or shorter depending on the weapon in hand.
+    action_time = ACTION_TIME * NORMAL_SPEED // actor.speed
+
+    if attacking and actor.fighter:
+        active_hand = actor.fighter.get_active_hand()
+
+        if active_hand and active_hand.weapon:
+            action_time = action_time * NORMAL_SPEED // active_hand.weapon.speed
+
+    return max(1, action_time)
+
+
+class TurnScheduler:
+    """
+    The monsters in the player's room, in a heap ordered by the time each one acts next. Each player action moves
+    the clock on by however long that action took, and only the monsters whose time comes up before then are
+    popped and act - fast monsters several times, slow ones only every few turns. Monsters due at the same time
+    act together as one batch, in the order they were scheduled.
+    Entries are never removed early: monsters that have died or been left behind are dropped as they come up.
+    """
+    def __init__(self):
+        self.time = 0
+        self.queue = []  # (time, sequence, monster) - the sequence breaks ties in scheduling order.
+        self.sequence = count()
+
+    def schedule(self, monster, time):
+        heappush(self.queue, (time, next(self.sequence), monster))
+
+    def enter_room(self, room_entities):  # The player is in a new room, so its monsters are the ones to schedule.
+        self.queue = []
+
+        for entity in room_entities:
+            if entity.ai:
+                self.schedule(entity, self.time)
+
+    def advance(self, action_time, target, game_map, entities):
+        """
+        Runs every monster turn due before the target's next action, action_time from now, and returns their
+        results. Stops early if the target dies.
+        """
+        end_time = self.time + action_time
+        results = []
+
+        while self.queue and self.queue[0][0] < end_time:
+            time = self.queue[0][0]
+
+            monsters = []
+            while self.queue and self.queue[0][0] == time:
+                monster = heappop(self.queue)[2]
+
+                if monster.ai and monster.current_room == target.current_room:
+                    monsters.append(monster)
+
+            if not monsters:
+                continue
+
+            turn_results = take_monster_turns(target, game_map, entities, monsters)
+            results.extend(turn_results)
+
+            if target.fighter.hits <= 0:
+                break
+
+            attackers = [result["attacker"] for result in turn_results if result.get("attacker")]
+
+            for monster in monsters:
+                self.schedule(monster, time + get_action_time(monster, attacking=monster in attackers))
+
+        self.time = end_time
+
+        return results
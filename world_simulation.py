@@ -0,0 +1,66 @@
+from ai_functions import wander_monsters
+from map_system_2 import UnloadedRoom
+import numpy
+import rng
+
+
+class WorldSimulation:
+    """
+    Keeps the rooms the player isn't in alive without simulating them every turn. Each room remembers the turn it
+    was last simulated up to. Every player turn, tick() fast-forwards at most room_budget of the rooms that have
+    fallen tick_interval or more turns behind, stalest first, so no one turn pays for the whole map. Entering a
+    room catches it up straight away, so the player never walks in on a room that has been frozen.
+    Rooms still on disk in a level pack are left alone until they are entered.
+    """
+    def __init__(self, tick_interval=10, room_budget=4):
+        self.tick_interval = tick_interval
+        self.room_budget = room_budget
+
+        self.last_simulated = {}  # room_id -> the turn the room has been simulated up to.
+
+        self.rooms_simulated = 0
+        self.turns_simulated = 0
+
+    def tick(self, turn, player, game_map, entities):
+        self.mark_simulated(player.current_room, turn)  # The player's room is simulated live every turn.
+
+        stale_rooms = []
+        for room_id in entities.occupied_rooms():
+            if room_id is None or room_id == player.current_room or not self.is_loaded(room_id, game_map):
+                continue
+
+            if turn - self.last_simulated.get(room_id, 0) >= self.tick_interval:
+                stale_rooms.append(room_id)
+
+        stale_rooms.sort(key=lambda room_id: self.last_simulated.get(room_id, 0))
+
+        for room_id in stale_rooms[:self.room_budget]:
+            self.catch_up(room_id, turn, game_map, entities)
+
+    def catch_up(self, room_id, turn, game_map, entities):  # Simulate a room up to this turn in one go.
+        if not self.is_loaded(room_id, game_map):
+            return
+
+        entry = game_map.rooms_index[room_id]
+        room = game_map.rooms[entry["map_x"]][entry["map_y"]]
+
+        elapsed_turns = turn - self.last_simulated.get(room_id, 0)
+        self.last_simulated[room_id] = turn
+
+        if elapsed_turns > 0:
+            random_generator = numpy.random.default_rng(rng.randint(0, 2 ** 32 - 1))
+            simulated_turns = wander_monsters(room, list(entities.in_room(room_id)), elapsed_turns, random_generator)
+
+            if simulated_turns:
+                self.rooms_simulated += 1
+                self.turns_simulated += simulated_turns
+
+    def mark_simulated(self, room_id, turn):  # The room is being simulated live, so it needn't be caught up.
+        self.last_simulated[room_id] = turn
+
+    def is_loaded(self, room_id, game_map):
+        entry = game_map.rooms_index[room_id]
+        return not isinstance(game_map.rooms[entry["map_x"]][entry["map_y"]], UnloadedRoom)
+
+    def stats(self):
+        return {"rooms_simulated": self.rooms_simulated, "turns_simulated": self.turns_simulated}